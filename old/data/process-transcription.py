@@ -1,9 +1,58 @@
 import boto3
 import json
 import base64
+import copy
+import sys
 from datetime import datetime
 
-def process_transcription_to_fhir():
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DEFAULT_PATIENT_ID = "684b7be0-40ff-40c9-aac1-fcbbe85819e1"
+
+# Fields shared by every transcription DocumentReference; subject, date and
+# content are placeholders overwritten per document (keeping the key order)
+DOCUMENT_REFERENCE_TEMPLATE = {
+    "resourceType": "DocumentReference",
+    "status": "current",
+    "type": {
+        "coding": [
+            {
+                "system": "http://loinc.org",
+                "code": "11488-4",
+                "display": "Consult note"
+            }
+        ]
+    },
+    "subject": None,
+    "date": None,
+    "author": [
+        {
+            "display": "Dr. Johnson, Interventional Cardiologist"
+        }
+    ],
+    "description": "Transcribed procedure note from cardiac catheterization",
+    "content": None,
+    "context": {
+        "period": {
+            "start": "2025-06-01T14:00:00Z",
+            "end": "2025-06-01T15:30:00Z"
+        }
+    }
+}
+
+def dump_json_bytes(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2).encode('utf-8')
+
+def process_transcription_to_fhir(transcription_path=None, now_iso=None, patient_id=DEFAULT_PATIENT_ID):
+    # Batch callers can pass one timestamp for the whole batch window
+    if now_iso is None:
+        now_iso = datetime.now().isoformat() + "Z"
+    
     # Simulated transcription text (from above)
     transcription_text = """Patient John Doe underwent left heart catheterization. 
 The procedure was performed via right femoral approach. Coronary angiography 
@@ -11,56 +60,38 @@ revealed normal coronary arteries with no significant stenosis. Left ventricular
 ejection fraction is estimated at sixty percent. Patient tolerated the procedure 
 well with no complications."""
     
-    # Properly encode as Base64
-    encoded_text = base64.b64encode(transcription_text.encode('utf-8')).decode('utf-8')
+    if transcription_path:
+        with open(transcription_path, 'rb') as src:
+            transcription_bytes = src.read()
+    else:
+        transcription_bytes = transcription_text.encode('utf-8')
+    encoded_data = base64.b64encode(transcription_bytes).decode('ascii')
     
-    # Create a DocumentReference FHIR resource from the transcription
-    document_reference = {
-        "resourceType": "DocumentReference",
-        "status": "current",
-        "type": {
-            "coding": [
-                {
-                    "system": "http://loinc.org",
-                    "code": "11488-4",
-                    "display": "Consult note"
-                }
-            ]
-        },
-        "subject": {
-            "reference": "Patient/684b7be0-40ff-40c9-aac1-fcbbe85819e1"
-        },
-        "date": datetime.now().isoformat() + "Z",
-        "author": [
-            {
-                "display": "Dr. Johnson, Interventional Cardiologist"
-            }
-        ],
-        "description": "Transcribed procedure note from cardiac catheterization",
-        "content": [
-            {
-                "attachment": {
-                    "contentType": "text/plain",
-                    "data": encoded_text
-                }
-            }
-        ],
-        "context": {
-            "period": {
-                "start": "2025-06-01T14:00:00Z",
-                "end": "2025-06-01T15:30:00Z"
+    # Create a DocumentReference FHIR resource from the transcription,
+    # filling in only the per-document fields of a private copy of the
+    # template so callers can't mutate the shared nested parts
+    document_reference = copy.deepcopy(DOCUMENT_REFERENCE_TEMPLATE)
+    document_reference["subject"] = {
+        "reference": f"Patient/{patient_id}"
+    }
+    document_reference["date"] = now_iso
+    document_reference["content"] = [
+        {
+            "attachment": {
+                "contentType": "text/plain",
+                "data": encoded_data
             }
         }
-    }
+    ]
     
     # Save to file for upload
-    with open('transcription-document.json', 'w') as f:
-        json.dump(document_reference, f, indent=2)
+    with open('transcription-document.json', 'wb') as f:
+        f.write(dump_json_bytes(document_reference))
     
     print("Created DocumentReference from transcription:")
-    print(f"Encoded text length: {len(encoded_text)} characters")
+    print(f"Encoded text length: {len(encoded_data)} characters")
     
     return document_reference
 
 if __name__ == "__main__":
-    process_transcription_to_fhir()
\ No newline at end of file
+    process_transcription_to_fhir(sys.argv[1] if len(sys.argv) > 1 else None)
\ No newline at end of file
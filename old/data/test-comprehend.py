@@ -1,10 +1,15 @@
 import boto3
 import json
+from botocore.config import Config
 
 def analyze_clinical_text():
     # Initialize Comprehend Medical client
     session = boto3.Session(profile_name='iamadmin-datalake-healthlake-365528423741', region_name='us-east-1')
-    comprehend_medical = session.client('comprehendmedical')
+    comprehend_medical = session.client('comprehendmedical', config=Config(
+        max_pool_connections=32,
+        retries={'mode': 'adaptive', 'max_attempts': 6},
+        tcp_keepalive=True
+    ))
     
     # Read clinical note
     with open('clinical-note.txt', 'r') as f:
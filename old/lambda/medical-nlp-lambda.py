@@ -1,90 +1,115 @@
 import json
 import boto3
+import os
+from botocore.config import Config
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Initialize client once per container so warm invocations reuse it
+client_config = Config(
+    max_pool_connections=32,
+    retries={'mode': 'adaptive', 'max_attempts': 6},
+    tcp_keepalive=True
+)
+comprehend_medical = boto3.client('comprehendmedical', region_name='us-east-1', config=client_config)
+
+def dumps(obj):
+    """Serialize a response body, with orjson when it is packaged"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj)
+
+def generate_uuids(count):
+    """Generate count random (version 4) UUIDs from a single os.urandom call"""
+    raw = os.urandom(16 * count)
+    return [str(uuid.UUID(bytes=raw[i:i + 16], version=4)) for i in range(0, 16 * count, 16)]
+
+def build_medication_statement(entity, resource_id, patient_id, now_iso):
+    return {
+        "resourceType": "MedicationStatement",
+        "id": resource_id,
+        "status": "active",
+        "medicationCodeableConcept": {
+            "text": entity['Text']
+        },
+        "subject": {
+            "reference": f"Patient/{patient_id}"
+        },
+        "effectiveDateTime": now_iso,
+        "note": [
+            {
+                "text": f"Extracted from clinical note. Confidence: {entity['Score']:.2f}"
+            }
+        ]
+    }
+
+def build_condition(entity, resource_id, patient_id, now_iso):
+    return {
+        "resourceType": "Condition",
+        "id": resource_id,
+        "clinicalStatus": {
+            "coding": [
+                {
+                    "system": "http://terminology.hl7.org/CodeSystem/condition-clinical",
+                    "code": "active"
+                }
+            ]
+        },
+        "code": {
+            "text": entity['Text']
+        },
+        "subject": {
+            "reference": f"Patient/{patient_id}"
+        },
+        "recordedDate": now_iso,
+        "note": [
+            {
+                "text": f"Extracted from clinical note. Confidence: {entity['Score']:.2f}"
+            }
+        ]
+    }
+
 def lambda_handler(event, context):
-    # Initialize clients
-    comprehend_medical = boto3.client('comprehendmedical', region_name='us-east-1')
-    healthlake = boto3.client('healthlake', region_name='us-east-1')
-    
     # Get the clinical text
     clinical_text = event.get('text', '')
     patient_id = event.get('patient_id', '')
     datastore_id = event.get('datastore_id', '')
     
     try:
-        # Extract medical entities
-        entities_response = comprehend_medical.detect_entities_v2(
-            Text=clinical_text
-        )
-        
-        # Extract medical relationships
-        relationships_response = comprehend_medical.detect_relationships_v2(
-            Text=clinical_text
-        )
+        # Extract medical entities and PHI concurrently -
+        # the two calls are independent network round trips
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            entities_future = executor.submit(comprehend_medical.detect_entities_v2, Text=clinical_text)
+            phi_future = executor.submit(comprehend_medical.detect_phi, Text=clinical_text)
+            
+            entities_response = entities_future.result()
+            phi_response = phi_future.result()
         
-        # Extract PHI
-        phi_response = comprehend_medical.detect_phi(
-            Text=clinical_text
-        )
+        # Create FHIR MedicationStatement and Condition resources
+        now_iso = datetime.now().isoformat() + "Z"
+        entities = entities_response['Entities']
+        medication_entities = [entity for entity in entities if entity['Category'] == 'MEDICATION']
+        condition_entities = [entity for entity in entities if entity['Category'] == 'MEDICAL_CONDITION']
+        resource_ids = iter(generate_uuids(len(medication_entities) + len(condition_entities)))
         
-        # Process medications and create FHIR MedicationStatement resources
-        medications = []
-        for entity in entities_response['Entities']:
-            if entity['Category'] == 'MEDICATION':
-                medication_statement = {
-                    "resourceType": "MedicationStatement",
-                    "id": str(uuid.uuid4()),
-                    "status": "active",
-                    "medicationCodeableConcept": {
-                        "text": entity['Text']
-                    },
-                    "subject": {
-                        "reference": f"Patient/{patient_id}"
-                    },
-                    "effectiveDateTime": datetime.now().isoformat() + "Z",
-                    "note": [
-                        {
-                            "text": f"Extracted from clinical note. Confidence: {entity['Score']:.2f}"
-                        }
-                    ]
-                }
-                medications.append(medication_statement)
-        
-        # Process conditions and create FHIR Condition resources
-        conditions = []
-        for entity in entities_response['Entities']:
-            if entity['Category'] == 'MEDICAL_CONDITION':
-                condition = {
-                    "resourceType": "Condition",
-                    "id": str(uuid.uuid4()),
-                    "clinicalStatus": {
-                        "coding": [
-                            {
-                                "system": "http://terminology.hl7.org/CodeSystem/condition-clinical",
-                                "code": "active"
-                            }
-                        ]
-                    },
-                    "code": {
-                        "text": entity['Text']
-                    },
-                    "subject": {
-                        "reference": f"Patient/{patient_id}"
-                    },
-                    "recordedDate": datetime.now().isoformat() + "Z",
-                    "note": [
-                        {
-                            "text": f"Extracted from clinical note. Confidence: {entity['Score']:.2f}"
-                        }
-                    ]
-                }
-                conditions.append(condition)
+        medications = [
+            build_medication_statement(entity, next(resource_ids), patient_id, now_iso)
+            for entity in medication_entities
+        ]
+        conditions = [
+            build_condition(entity, next(resource_ids), patient_id, now_iso)
+            for entity in condition_entities
+        ]
         
         return {
             'statusCode': 200,
-            'body': json.dumps({
+            'body': dumps({
                 'message': 'Medical NLP processing completed',
                 'entities_found': len(entities_response['Entities']),
                 'medications': medications,
@@ -96,7 +121,7 @@ def lambda_handler(event, context):
     except Exception as e:
         return {
             'statusCode': 500,
-            'body': json.dumps({
+            'body': dumps({
                 'error': str(e)
             })
         }
\ No newline at end of file
@@ -1,13 +1,32 @@
 #!/usr/bin/env python3
 import boto3
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import sys
 import hashlib
 import hmac
-from datetime import datetime
+from datetime import datetime, timezone
+from functools import lru_cache
 from urllib.parse import urlparse
 
+# Pooled HTTP session; idempotent requests are retried when throttled or failed
+http = requests.Session()
+http.mount('https://', HTTPAdapter(
+    max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504],
+                      raise_on_status=False)
+))
+
+@lru_cache(maxsize=8)
+def get_signature_key(key, date_stamp, region_name, service_name):
+    # The derived key only changes with the date, so it is computed once per day
+    k_date = hmac.new(('AWS4' + key).encode('utf-8'), date_stamp.encode('utf-8'), hashlib.sha256).digest()
+    k_region = hmac.new(k_date, region_name.encode('utf-8'), hashlib.sha256).digest()
+    k_service = hmac.new(k_region, service_name.encode('utf-8'), hashlib.sha256).digest()
+    k_signing = hmac.new(k_service, b'aws4_request', hashlib.sha256).digest()
+    return k_signing
+
 def sign_aws_request(method, url, data=None, profile_name=None):
     # Get AWS credentials
     session = boto3.Session(profile_name=profile_name)
@@ -27,28 +46,28 @@ def sign_aws_request(method, url, data=None, profile_name=None):
     algorithm = 'AWS4-HMAC-SHA256'
     
     # Create timestamp
-    t = datetime.utcnow()
+    t = datetime.now(timezone.utc)
     amz_date = t.strftime('%Y%m%dT%H%M%SZ')
     date_stamp = t.strftime('%Y%m%d')
     
-    # Prepare payload
+    # Prepare payload as bytes, so it is hashed and sent without re-encoding
     if data:
         if isinstance(data, str):
             if data.startswith('@'):
                 # Handle @filename format
-                with open(data[1:], 'r') as f:
+                with open(data[1:], 'rb') as f:
                     payload = f.read()
             elif data.endswith('.json'):
                 # Handle filename.json format
-                with open(data, 'r') as f:
+                with open(data, 'rb') as f:
                     payload = f.read()
             else:
                 # Handle direct JSON string
-                payload = data
+                payload = data.encode('utf-8')
         else:
-            payload = json.dumps(data)
+            payload = json.dumps(data).encode('utf-8')
     else:
-        payload = ''
+        payload = b''
     
     # Create canonical headers
     canonical_headers = f'content-type:application/fhir+json\n'
@@ -63,7 +82,7 @@ def sign_aws_request(method, url, data=None, profile_name=None):
         signed_headers += ';x-amz-security-token'
     
     # Create payload hash
-    payload_hash = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    payload_hash = hashlib.sha256(payload).hexdigest()
     
     # Create canonical request
     canonical_request = f'{method}\n{path}\n\n{canonical_headers}\n{signed_headers}\n{payload_hash}'
@@ -73,13 +92,6 @@ def sign_aws_request(method, url, data=None, profile_name=None):
     string_to_sign = f'{algorithm}\n{amz_date}\n{credential_scope}\n{hashlib.sha256(canonical_request.encode()).hexdigest()}'
     
     # Calculate signature
-    def get_signature_key(key, date_stamp, region_name, service_name):
-        k_date = hmac.new(('AWS4' + key).encode('utf-8'), date_stamp.encode('utf-8'), hashlib.sha256).digest()
-        k_region = hmac.new(k_date, region_name.encode('utf-8'), hashlib.sha256).digest()
-        k_service = hmac.new(k_region, service_name.encode('utf-8'), hashlib.sha256).digest()
-        k_signing = hmac.new(k_service, b'aws4_request', hashlib.sha256).digest()
-        return k_signing
-    
     signing_key = get_signature_key(credentials.secret_key, date_stamp, region, service)
     signature = hmac.new(signing_key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
     
@@ -111,7 +123,8 @@ def make_curl_command(method, url, data_file=None, profile_name=None):
         
         if payload and method.upper() != 'GET':
             # For demonstration, show the data inline
-            curl_cmd += f' \\\n    -d \'{payload}\''
+            payload_for_curl = payload.decode('utf-8', 'replace')
+            curl_cmd += f' \\\n    -d \'{payload_for_curl}\''
         
         print("Generated CURL command:")
         print("=" * 50)
@@ -122,11 +135,11 @@ def make_curl_command(method, url, data_file=None, profile_name=None):
         print("\nMaking actual request...")
         
         if method.upper() == 'GET':
-            response = requests.get(url, headers=headers)
+            response = http.get(url, headers=headers)
         elif method.upper() == 'POST':
-            response = requests.post(url, headers=headers, data=payload)
+            response = http.post(url, headers=headers, data=payload)
         else:
-            response = requests.request(method, url, headers=headers, data=payload)
+            response = http.request(method, url, headers=headers, data=payload)
         
         print(f"Status Code: {response.status_code}")
         print(f"Response Headers: {dict(response.headers)}")
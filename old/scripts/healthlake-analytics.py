@@ -6,14 +6,92 @@ Perfect for GoCathLab demonstrations
 """
 
 import json
+import sys
+import time
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import boto3
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-import base64
-from io import StringIO
+from urllib.parse import quote
+
+# Seconds a FHIR response is reused before it is fetched again, and how
+# many responses are kept
+FHIR_CACHE_TTL = 60
+FHIR_CACHE_MAXSIZE = 64
+
+# Seconds signed request headers are reused (SigV4 allows 5 minutes of clock
+# skew), and for how many URLs
+SIGNED_HEADERS_TTL = 240
+SIGNED_HEADERS_MAXSIZE = 64
+
+# LOINC codes of the cardiovascular vital signs in the data store
+HEART_RATE_LOINC = "http://loinc.org|8867-4"
+BLOOD_PRESSURE_LOINC = "http://loinc.org|85354-9"
+
+# Largest page size HealthLake accepts for a search
+FHIR_PAGE_SIZE = 100
+
+# Base64 characters decoded for a document preview: the preview needs 201
+# characters (200 plus one to detect truncation), up to 804 bytes of UTF-8,
+# which is ceil(804 / 3) * 4 = 1072 Base64 characters
+PREVIEW_BASE64_CHARS = 1072
+
+# Lines buffered before each stdout write while streaming a report section
+OUTPUT_BATCH_LINES = 100
+
+# Shared fallbacks for optional FHIR lists, so no new list is built per resource
+EMPTY_ELEMENT = ({},)
+EMPTY_STRING = ('',)
+
+class ExpiringLRUCache:
+    """Thread-safe cache of at most maxsize entries, each kept for ttl seconds, evicting the least recently used"""
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the live value for key, or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] >= self.ttl:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        """Store value for key, evicting the least recently used entry when full"""
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        """Drop all entries"""
+        with self.lock:
+            self.entries.clear()
+
+def write_lines(lines):
+    """Stream per-resource output, writing to stdout every OUTPUT_BATCH_LINES lines"""
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= OUTPUT_BATCH_LINES:
+            sys.stdout.write('\n'.join(batch) + '\n')
+            batch.clear()
+    if batch:
+        sys.stdout.write('\n'.join(batch) + '\n')
 
 class HealthLakeAnalytics:
     def __init__(self, datastore_id, profile_name):
@@ -22,12 +100,26 @@ class HealthLakeAnalytics:
         self.base_url = f"https://healthlake.us-east-1.amazonaws.com/datastore/{datastore_id}/r4"
         self.session = boto3.Session(profile_name=profile_name)
         self.credentials = self.session.get_credentials()
+        self.signer = SigV4Auth(self.credentials, 'healthlake', 'us-east-1')
+        
+        # One pooled HTTP session for all FHIR requests, so TLS connections
+        # to HealthLake are reused and throttled or failed GETs are retried
+        self.http = requests.Session()
+        self.http.mount('https://', HTTPAdapter(
+            pool_connections=8,
+            pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504],
+                              raise_on_status=False)
+        ))
+        
+        # request URL -> response
+        self.fhir_cache = ExpiringLRUCache(FHIR_CACHE_MAXSIZE, FHIR_CACHE_TTL)
+        
+        # request URL -> (credentials, signed headers)
+        self.signed_headers_cache = ExpiringLRUCache(SIGNED_HEADERS_MAXSIZE, SIGNED_HEADERS_TTL)
         
     def make_fhir_request(self, resource_type="", resource_id="", params=None):
         """Make authenticated FHIR API request"""
-        from botocore.auth import SigV4Auth
-        from botocore.awsrequest import AWSRequest
-        
         if resource_id:
             url = f"{self.base_url}/{resource_type}/{resource_id}"
         elif params:
@@ -35,37 +127,75 @@ class HealthLakeAnalytics:
         else:
             url = f"{self.base_url}/{resource_type}"
         
+        return self.get_fhir_url(url, resource_type)
+
+    def get_fhir_url(self, url, resource_type):
+        """GET a FHIR URL, reusing its response for FHIR_CACHE_TTL seconds"""
+        data = self.fhir_cache.get(url)
+        if data is not None:
+            return data
+        
+        data = self.fetch_fhir(url, resource_type)
+        if data is not None:
+            self.fhir_cache.put(url, data)
+        return data
+
+    def clear_fhir_cache(self):
+        """Drop all cached FHIR responses"""
+        self.fhir_cache.clear()
+
+    def fetch_fhir(self, url, resource_type):
+        """Fetch a FHIR resource or search Bundle page from HealthLake"""
+        response = self.http.get(url, headers=self.sign_get(url))
+        
+        if response.status_code == 200:
+            return response.json()
+        else:
+            print(f"Error fetching {resource_type}: {response.status_code}")
+            return None
+
+    def sign_get(self, url):
+        """Sign a GET of a FHIR URL, reusing its headers while they are fresh and the credentials unchanged"""
+        credentials = self.credentials.get_frozen_credentials()
+        cached = self.signed_headers_cache.get(url)
+        if cached and cached[0] == credentials:
+            return cached[1]
+        
         headers = {
             'Content-Type': 'application/fhir+json',
             'Accept': 'application/fhir+json'
         }
         
         request = AWSRequest(method='GET', url=url, headers=headers)
-        SigV4Auth(self.credentials, 'healthlake', 'us-east-1').add_auth(request)
+        self.signer.add_auth(request)
         
-        response = requests.get(url, headers=dict(request.headers))
+        signed_headers = dict(request.headers)
+        self.signed_headers_cache.put(url, (credentials, signed_headers))
+        return signed_headers
+
+    def iter_resources(self, resource_type, params=None):
+        """Yield every resource of a search, following the Bundle's next links page by page"""
+        bundle = self.make_fhir_request(resource_type, params=params)
         
-        if response.status_code == 200:
-            return response.json()
-        else:
-            print(f"Error fetching {resource_type}: {response.status_code}")
-            return None
+        # Fetch the next page while the current one is being consumed. Later
+        # pages bypass the response cache, so only one page is held at a time
+        with ThreadPoolExecutor(max_workers=1) as prefetch:
+            while bundle:
+                next_url = next(
+                    (link['url'] for link in bundle.get('link', ()) if link.get('relation') == 'next'),
+                    None
+                )
+                next_page = prefetch.submit(self.fetch_fhir, next_url, resource_type) if next_url else None
+                
+                for entry in bundle.get('entry', ()):
+                    yield entry['resource']
+                
+                bundle = next_page.result() if next_page else None
 
-    def get_all_patients(self):
-        """Fetch all patients"""
-        return self.make_fhir_request("Patient")
-    
-    def get_all_observations(self):
-        """Fetch all observations"""
-        return self.make_fhir_request("Observation")
-    
-    def get_all_documents(self):
-        """Fetch all document references"""
-        return self.make_fhir_request("DocumentReference")
-    
-    def get_all_procedures(self):
-        """Fetch all procedures"""
-        return self.make_fhir_request("Procedure")
+    def get_observations_by_codes(self, loinc_codes):
+        """Yield only the Observations with the given LOINC codes, filtered by HealthLake"""
+        codes = ','.join(quote(code, safe='') for code in loinc_codes)
+        return self.iter_resources("Observation", f"code={codes}&_count={FHIR_PAGE_SIZE}")
 
     def analyze_resource_distribution(self):
         """Analyze distribution of FHIR resources"""
@@ -73,19 +203,22 @@ class HealthLakeAnalytics:
         print("=" * 50)
         
         resources = {
-            "Patients": self.get_all_patients(),
-            "Observations": self.get_all_observations(),
-            "Documents": self.get_all_documents(),
-            "Procedures": self.get_all_procedures()
+            "Patients": "Patient",
+            "Observations": "Observation",
+            "Documents": "DocumentReference",
+            "Procedures": "Procedure"
         }
         
-        distribution = {}
-        for resource_type, data in resources.items():
-            if data and 'entry' in data:
-                count = len(data['entry'])
-            else:
-                count = 0
-            distribution[resource_type] = count
+        # Only the ids are needed to count, so no resource bodies are downloaded.
+        # The searches are independent and run concurrently
+        with ThreadPoolExecutor(max_workers=len(resources)) as executor:
+            counts = executor.map(
+                lambda fhir_type: sum(1 for _ in self.iter_resources(fhir_type, f"_elements=id&_count={FHIR_PAGE_SIZE}")),
+                resources.values()
+            )
+            distribution = dict(zip(resources, counts))
+        
+        for resource_type, count in distribution.items():
             print(f"{resource_type}: {count}")
         
         return distribution
@@ -95,27 +228,33 @@ class HealthLakeAnalytics:
         print("\n💓 Vital Signs Analysis")
         print("=" * 30)
         
-        observations = self.get_all_observations()
-        if not observations or 'entry' not in observations:
+        vital_signs = self.extract_vital_signs(self.iter_resources("Observation"))
+        
+        if not vital_signs:
             print("No observations found")
-            return []
+            return vital_signs
         
+        # Display vital signs
+        write_lines(f"  {vital['type']}: {vital['value']} {vital['unit']} ({vital['date']})" for vital in vital_signs)
+        
+        return vital_signs
+
+    def extract_vital_signs(self, observations):
+        """Flatten Observations into one vital sign per value or component"""
         vital_signs = []
         
-        for entry in observations['entry']:
-            obs = entry['resource']
-            
+        for obs in observations:
             # Extract basic observation info
             obs_data = {
                 'patient_id': obs.get('subject', {}).get('reference', '').replace('Patient/', ''),
                 'date': obs.get('effectiveDateTime', ''),
-                'performer': obs.get('performer', [{}])[0].get('display', 'Unknown'),
+                'performer': (obs.get('performer') or EMPTY_ELEMENT)[0].get('display', 'Unknown'),
                 'status': obs.get('status', '')
             }
             
             # Handle single-value observations (like heart rate)
             if 'valueQuantity' in obs:
-                code_info = obs.get('code', {}).get('coding', [{}])[0]
+                code_info = (obs.get('code', {}).get('coding') or EMPTY_ELEMENT)[0]
                 obs_data.update({
                     'type': code_info.get('display', 'Unknown'),
                     'value': obs['valueQuantity'].get('value'),
@@ -128,7 +267,7 @@ class HealthLakeAnalytics:
             elif 'component' in obs:
                 for component in obs['component']:
                     comp_data = obs_data.copy()
-                    code_info = component.get('code', {}).get('coding', [{}])[0]
+                    code_info = (component.get('code', {}).get('coding') or EMPTY_ELEMENT)[0]
                     comp_data.update({
                         'type': code_info.get('display', 'Unknown'),
                         'value': component.get('valueQuantity', {}).get('value'),
@@ -137,10 +276,6 @@ class HealthLakeAnalytics:
                     })
                     vital_signs.append(comp_data)
         
-        # Display vital signs
-        for vital in vital_signs:
-            print(f"  {vital['type']}: {vital['value']} {vital['unit']} ({vital['date']})")
-        
         return vital_signs
 
     def analyze_patient_demographics(self):
@@ -148,21 +283,23 @@ class HealthLakeAnalytics:
         print("\n👥 Patient Demographics")
         print("=" * 25)
         
-        patients = self.get_all_patients()
-        if not patients or 'entry' not in patients:
+        demographics = []
+        write_lines(self.iter_demographic_lines(demographics))
+        
+        if not demographics:
             print("No patients found")
-            return []
         
-        demographics = []
-        for entry in patients['entry']:
-            patient = entry['resource']
-            
+        return demographics
+
+    def iter_demographic_lines(self, demographics):
+        """Yield report lines per Patient, collecting each patient's data into demographics"""
+        for patient in self.iter_resources("Patient"):
             # Extract name
-            name_info = patient.get('name', [{}])[0]
-            full_name = f"{name_info.get('given', [''])[0]} {name_info.get('family', '')}"
+            name_info = (patient.get('name') or EMPTY_ELEMENT)[0]
+            full_name = f"{(name_info.get('given') or EMPTY_STRING)[0]} {name_info.get('family', '')}"
             
             # Extract address
-            address_info = patient.get('address', [{}])[0]
+            address_info = (patient.get('address') or EMPTY_ELEMENT)[0]
             location = f"{address_info.get('city', '')}, {address_info.get('state', '')}"
             
             demo_data = {
@@ -175,73 +312,79 @@ class HealthLakeAnalytics:
             }
             demographics.append(demo_data)
             
-            print(f"  {demo_data['name']} ({demo_data['gender']}, born {demo_data['birth_date']})")
-            print(f"    Location: {demo_data['location']}")
-            print(f"    Status: {'Active' if demo_data['active'] else 'Inactive'}")
-        
-        return demographics
+            yield f"  {demo_data['name']} ({demo_data['gender']}, born {demo_data['birth_date']})"
+            yield f"    Location: {demo_data['location']}"
+            yield f"    Status: {'Active' if demo_data['active'] else 'Inactive'}"
 
     def analyze_clinical_documents(self):
         """Analyze clinical documents"""
         print("\n📄 Clinical Documents Analysis")
         print("=" * 35)
         
-        documents = self.get_all_documents()
-        if not documents or 'entry' not in documents:
+        doc_analysis = []
+        write_lines(self.iter_document_lines(doc_analysis))
+        
+        if not doc_analysis:
             print("No documents found")
-            return []
         
-        doc_analysis = []
-        for entry in documents['entry']:
-            doc = entry['resource']
-            
+        return doc_analysis
+
+    def iter_document_lines(self, doc_analysis):
+        """Yield report lines per DocumentReference, collecting each document's data into doc_analysis"""
+        import base64
+        
+        for doc in self.iter_resources("DocumentReference"):
             # Decode document content if available
             content_text = "Content not available"
             if 'content' in doc and doc['content']:
                 try:
-                    encoded_data = doc['content'][0].get('attachment', {}).get('data', '')
-                    if encoded_data:
-                        decoded_bytes = base64.b64decode(encoded_data)
-                        content_text = decoded_bytes.decode('utf-8')
+                    attachment = doc['content'][0].get('attachment', {})
+                    encoded_data = attachment.get('data', '').replace('\n', '')
+                    if encoded_data and attachment.get('contentType', 'text/plain').startswith('text/'):
+                        # Only a preview is kept, so decode just enough of the attachment for it;
+                        # the slice may end inside a multi-byte character, which is dropped
+                        decoded_bytes = base64.b64decode(encoded_data[:PREVIEW_BASE64_CHARS])
+                        content_text = decoded_bytes.decode('utf-8', 'ignore')
                 except:
                     content_text = "Could not decode content"
             
             doc_data = {
                 'id': doc.get('id'),
-                'type': doc.get('type', {}).get('coding', [{}])[0].get('display', 'Unknown'),
+                'type': (doc.get('type', {}).get('coding') or EMPTY_ELEMENT)[0].get('display', 'Unknown'),
                 'date': doc.get('date'),
-                'author': doc.get('author', [{}])[0].get('display', 'Unknown'),
+                'author': (doc.get('author') or EMPTY_ELEMENT)[0].get('display', 'Unknown'),
                 'description': doc.get('description', ''),
                 'patient_id': doc.get('subject', {}).get('reference', '').replace('Patient/', ''),
                 'content_preview': content_text[:200] + "..." if len(content_text) > 200 else content_text
             }
             doc_analysis.append(doc_data)
             
-            print(f"  Document: {doc_data['type']}")
-            print(f"    Author: {doc_data['author']}")
-            print(f"    Date: {doc_data['date']}")
-            print(f"    Description: {doc_data['description']}")
-            print(f"    Preview: {doc_data['content_preview']}")
-        
-        return doc_analysis
+            yield f"  Document: {doc_data['type']}"
+            yield f"    Author: {doc_data['author']}"
+            yield f"    Date: {doc_data['date']}"
+            yield f"    Description: {doc_data['description']}"
+            yield f"    Preview: {doc_data['content_preview']}"
 
-    def create_cardiovascular_summary(self):
-        """Create cardiovascular-specific summary for GoCathLab"""
+    def create_cardiovascular_summary(self, demographics=None, vitals=None, documents=None):
+        """Create cardiovascular-specific summary for GoCathLab, from already analyzed data when given"""
+        # Get any data not passed in
+        if demographics is None:
+            demographics = self.analyze_patient_demographics()
+        if vitals is None:
+            vitals = self.analyze_vital_signs()
+        if documents is None:
+            documents = self.analyze_clinical_documents()
+        
         print("\n🫀 CARDIOVASCULAR SUMMARY FOR GOCATHLAB")
         print("=" * 45)
         
-        # Get all data
-        demographics = self.analyze_patient_demographics()
-        vitals = self.analyze_vital_signs()
-        documents = self.analyze_clinical_documents()
-        
         # Cardiovascular-specific analysis
         cv_summary = {
             'total_patients': len(demographics),
             'total_vital_measurements': len(vitals),
             'total_clinical_notes': len(documents),
-            'heart_rate_readings': [v for v in vitals if 'heart rate' in v.get('type', '').lower()],
-            'bp_readings': [v for v in vitals if 'blood pressure' in v.get('type', '').lower()],
+            'heart_rate_readings': self.extract_vital_signs(self.get_observations_by_codes([HEART_RATE_LOINC])),
+            'bp_readings': self.extract_vital_signs(self.get_observations_by_codes([BLOOD_PRESSURE_LOINC])),
             'procedure_notes': [d for d in documents if 'catheter' in d.get('content_preview', '').lower()]
         }
         
@@ -252,19 +395,22 @@ class HealthLakeAnalytics:
         print(f"  • Blood Pressure Readings: {len(cv_summary['bp_readings'])}")
         print(f"  • Catheterization Notes: {len(cv_summary['procedure_notes'])}")
         
-        # Clinical insights
+        # Clinical insights. pandas is only imported by reports that need it
+        import pandas as pd
+        
         if cv_summary['heart_rate_readings']:
-            hr_values = [r['value'] for r in cv_summary['heart_rate_readings'] if r['value']]
-            if hr_values:
-                avg_hr = sum(hr_values) / len(hr_values)
-                print(f"  • Average Heart Rate: {avg_hr:.1f} bpm")
+            hr_values = pd.to_numeric(pd.DataFrame(cv_summary['heart_rate_readings'])['value'], errors='coerce')
+            hr_values = hr_values[hr_values != 0].dropna()
+            if not hr_values.empty:
+                print(f"  • Average Heart Rate: {hr_values.mean():.1f} bpm")
         
         if cv_summary['bp_readings']:
-            systolic = [r['value'] for r in cv_summary['bp_readings'] if 'systolic' in r.get('type', '').lower()]
-            diastolic = [r['value'] for r in cv_summary['bp_readings'] if 'diastolic' in r.get('type', '').lower()]
+            bp = pd.DataFrame(cv_summary['bp_readings'])
+            systolic = bp.loc[bp['type'].str.contains('systolic', case=False, regex=False, na=False), 'value']
+            diastolic = bp.loc[bp['type'].str.contains('diastolic', case=False, regex=False, na=False), 'value']
             
-            if systolic and diastolic:
-                print(f"  • Blood Pressure: {systolic[0]:.0f}/{diastolic[0]:.0f} mmHg")
+            if not systolic.empty and not diastolic.empty:
+                print(f"  • Blood Pressure: {systolic.iloc[0]:.0f}/{diastolic.iloc[0]:.0f} mmHg")
         
         print(f"\n✅ Data Quality:")
         print(f"  • Complete patient records with demographics")
@@ -287,7 +433,7 @@ class HealthLakeAnalytics:
         demographics = self.analyze_patient_demographics()
         vitals = self.analyze_vital_signs()
         documents = self.analyze_clinical_documents()
-        cv_summary = self.create_cardiovascular_summary()
+        cv_summary = self.create_cardiovascular_summary(demographics, vitals, documents)
         
         print(f"\n🎯 SUMMARY FOR GOCATHLAB DEMONSTRATION:")
         print(f"  ✅ Complete FHIR data store operational")
@@ -1,26 +1,85 @@
+import gzip
 import json
-import boto3
+from concurrent.futures import ThreadPoolExecutor
+import re
 import urllib.parse
 import logging
 import uuid
 import time
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Tuple
 import os
 
+from comprehend_medical import get_client, load_json, dump_json, detect_entities_and_phi
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize AWS clients
-transcribe_client = boto3.client('transcribe')
-s3_client = boto3.client('s3')
-comprehend_medical = boto3.client('comprehendmedical')
+# Transcription jobs started by this pipeline
+JOB_NAME_PREFIX = 'gocathlab-transcription-'
+
+# Transcript URIs come as https://bucket-name.s3.region.amazonaws.com/key
+# or https://s3.region.amazonaws.com/bucket-name/key
+S3_URL_RE = re.compile(
+    r'^https://(?:(?P<vhost>[^/]+?)\.s3[.-][^/]+/(?P<key1>.+)'
+    r'|s3[.-][^/]+/(?P<bucket>[^/]+)/(?P<key2>.+))$'
+)
+
+# Cath lab specific terms
+CATH_LAB_TERMS = (
+    'catheter', 'guidewire', 'balloon', 'stent', 'contrast',
+    'fluoroscopy', 'angiography', 'hemodynamics', 'pressure',
+    'injection', 'vessel', 'artery', 'coronary', 'lad', 'rca', 'lcx',
+    'stenosis', 'occlusion', 'thrombus', 'dissection',
+    'complications', 'bleeding', 'hematoma', 'perforation',
+    'access site', 'femoral', 'radial', 'closure device',
+    'procedure time', 'contrast volume', 'radiation dose'
+)
+
+# Cardiovascular procedures specific to cath lab
+CATH_PROCEDURES = (
+    'angioplasty', 'ptca', 'pci', 'stenting', 'atherectomy',
+    'thrombectomy', 'balloon angioplasty', 'drug eluting stent',
+    'bare metal stent', 'rotablation', 'cutting balloon',
+    'intravascular ultrasound', 'ivus', 'oct', 'ffr',
+    'fractional flow reserve', 'instantaneous wave free ratio'
+)
+
+# Keywords marking an existing entity as cardiovascular
+CARDIO_KEYWORDS = (
+    'coronary', 'cardiac', 'heart', 'cardiovascular', 'vessel',
+    'artery', 'stenosis', 'ischemia', 'myocardial', 'angina'
+)
+
+# Matchers are built once per container. The lookahead finds every position
+# where any cath lab term starts in a single scan of the transcript; the terms
+# sharing that first byte are then checked at the position, so overlapping
+# terms (e.g. 'balloon' and 'balloon angioplasty') are all found. The terms
+# are ASCII, so the scan runs over bytes rather than unicode strings.
+CATH_TERM_CATEGORIES = {term: 'cath_lab_equipment' for term in CATH_LAB_TERMS}
+CATH_TERM_CATEGORIES.update({term: 'cath_lab_procedure' for term in CATH_PROCEDURES})
+
+CATH_TERM_BYTES = {term.encode('ascii'): term for term in CATH_TERM_CATEGORIES}
+
+CATH_TERMS_BY_INITIAL = {
+    initial: tuple(term for term in CATH_TERM_BYTES if term[0] == initial)
+    for initial in {term[0] for term in CATH_TERM_BYTES}
+}
+
+CATH_TERM_START_RE = re.compile(b'(?=' + b'|'.join(map(re.escape, CATH_TERM_BYTES)) + b')')
+CARDIO_KEYWORD_RE = re.compile('|'.join(map(re.escape, CARDIO_KEYWORDS)))
 
 def handler(event, context):
     """
-    Lambda function to transcribe medical audio files using Amazon Transcribe Medical
-    and then process the transcription with Comprehend Medical
+    Lambda function to start Amazon Transcribe Medical jobs for uploaded audio files.
+    Results are processed by transcription_completion_handler once Transcribe
+    reports the job state change through EventBridge
     """
     try:
         # Parse S3 event
@@ -32,38 +91,76 @@ def handler(event, context):
         # Start medical transcription job
         job_name = start_medical_transcription(bucket, key)
         
-        # Wait for transcription to complete and get results
-        transcription_text = wait_for_transcription_completion(job_name)
-        
-        if transcription_text:
-            # Process transcription with Comprehend Medical
-            nlp_results = process_transcription_with_nlp(transcription_text, key)
-            
-            # Save results to output bucket
-            save_transcription_results(nlp_results, key)
-            
-            return {
-                'statusCode': 200,
-                'body': json.dumps({
-                    'message': 'Audio transcription and NLP processing completed',
-                    'job_name': job_name,
-                    'input_file': key,
-                    'transcription_length': len(transcription_text),
-                    'entities_detected': len(nlp_results.get('entities', []))
-                })
-            }
-        else:
-            raise Exception("Transcription failed or returned empty results")
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'message': 'Audio transcription started',
+                'job_name': job_name,
+                'input_file': key
+            })
+        }
             
     except Exception as e:
         logger.error(f"Error processing audio file: {str(e)}")
         raise e
 
+def transcription_completion_handler(event, context):
+    """
+    Lambda function triggered by the EventBridge "Transcribe Job State Change" event.
+    Downloads the finished transcription and processes it with Comprehend Medical
+    """
+    try:
+        detail = event['detail']
+        job_name = detail.get('MedicalTranscriptionJobName') or detail.get('TranscriptionJobName')
+        
+        if not job_name or not job_name.startswith(JOB_NAME_PREFIX):
+            logger.info(f"Ignoring transcription job not started by this pipeline: {job_name}")
+            return {'statusCode': 200, 'body': 'Ignored'}
+        
+        job = get_client('transcribe').get_medical_transcription_job(
+            MedicalTranscriptionJobName=job_name
+        )['MedicalTranscriptionJob']
+        
+        status = job['TranscriptionJobStatus']
+        logger.info(f"Transcription job {job_name} status: {status}")
+        
+        if status != 'COMPLETED':
+            failure_reason = job.get('FailureReason', 'Unknown')
+            raise Exception(f"Transcription job failed: {failure_reason}")
+        
+        # The original audio key is recovered from the job's media URI
+        _, key = parse_s3_uri(job['Media']['MediaFileUri'])
+        transcription_text = download_transcription_results(job['Transcript']['TranscriptFileUri'])
+        
+        if not transcription_text:
+            raise Exception("Transcription returned empty results")
+        
+        # Process transcription with Comprehend Medical
+        nlp_results = process_transcription_with_nlp(transcription_text, key)
+        
+        # Save results to output bucket
+        save_transcription_results(nlp_results, key, transcription_text)
+        
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'message': 'Audio transcription and NLP processing completed',
+                'job_name': job_name,
+                'input_file': key,
+                'transcription_length': len(transcription_text),
+                'entities_detected': len(nlp_results.get('entities', []))
+            })
+        }
+        
+    except Exception as e:
+        logger.error(f"Error processing transcription results: {str(e)}")
+        raise e
+
 def start_medical_transcription(bucket: str, key: str) -> str:
     """
     Start a medical transcription job
     """
-    job_name = f"gocathlab-transcription-{uuid.uuid4().hex[:8]}-{int(time.time())}"
+    job_name = f"{JOB_NAME_PREFIX}{uuid.uuid4().hex[:8]}-{int(time.time())}"
     
     media_uri = f"s3://{bucket}/{key}"
     
@@ -78,7 +175,7 @@ def start_medical_transcription(bucket: str, key: str) -> str:
     }.get(file_extension, 'wav')
     
     try:
-        response = transcribe_client.start_medical_transcription_job(
+        response = get_client('transcribe').start_medical_transcription_job(
             MedicalTranscriptionJobName=job_name,
             LanguageCode='en-US',
             # Remove MediaSampleRateHertz to let Transcribe auto-detect
@@ -107,77 +204,36 @@ def start_medical_transcription(bucket: str, key: str) -> str:
         logger.error(f"Error starting transcription job: {str(e)}")
         raise e
 
-def wait_for_transcription_completion(job_name: str, max_wait_time: int = 900) -> Optional[str]:
+def parse_s3_uri(uri: str) -> Tuple[str, str]:
     """
-    Wait for transcription job to complete and return the transcription text
+    Split an S3 https (virtual-hosted or path style) or s3:// URI into bucket and key
     """
-    start_time = time.time()
+    match = S3_URL_RE.match(uri)
+    if match:
+        return match['vhost'] or match['bucket'], match['key1'] or match['key2']
     
-    while time.time() - start_time < max_wait_time:
-        try:
-            response = transcribe_client.get_medical_transcription_job(
-                MedicalTranscriptionJobName=job_name
-            )
-            
-            status = response['MedicalTranscriptionJob']['TranscriptionJobStatus']
-            logger.info(f"Transcription job {job_name} status: {status}")
-            
-            if status == 'COMPLETED':
-                # Get transcription results
-                transcript_uri = response['MedicalTranscriptionJob']['Transcript']['TranscriptFileUri']
-                return download_transcription_results(transcript_uri)
-                
-            elif status == 'FAILED':
-                failure_reason = response['MedicalTranscriptionJob'].get('FailureReason', 'Unknown')
-                raise Exception(f"Transcription job failed: {failure_reason}")
-                
-            # Wait before checking again
-            time.sleep(30)
-            
-        except Exception as e:
-            logger.error(f"Error checking transcription status: {str(e)}")
-            raise e
-    
-    raise Exception(f"Transcription job {job_name} did not complete within {max_wait_time} seconds")
+    parsed = urllib.parse.urlparse(uri)
+    return parsed.netloc, parsed.path.lstrip('/')
 
 def download_transcription_results(transcript_uri: str) -> str:
     """
     Download transcription results from S3 URI
     """
     try:
-        # Parse S3 URI properly
-        # transcript_uri looks like: https://s3.us-east-1.amazonaws.com/bucket-name/path/to/file.json
-        
-        if transcript_uri.startswith('https://'):
-            # Extract bucket and key from HTTPS URL
-            # Format: https://s3.region.amazonaws.com/bucket-name/path/to/file.json
-            # or: https://bucket-name.s3.region.amazonaws.com/path/to/file.json
-            
-            if '.s3.' in transcript_uri:
-                # Format: https://bucket-name.s3.region.amazonaws.com/path/to/file.json
-                parts = transcript_uri.replace('https://', '').split('/')
-                bucket_and_region = parts[0]  # bucket-name.s3.region.amazonaws.com
-                bucket = bucket_and_region.split('.s3.')[0]  # bucket-name
-                key = '/'.join(parts[1:])  # path/to/file.json
-            else:
-                # Format: https://s3.region.amazonaws.com/bucket-name/path/to/file.json
-                parts = transcript_uri.replace('https://', '').split('/')
-                bucket = parts[1] if len(parts) > 1 else parts[0]  # bucket-name
-                key = '/'.join(parts[2:]) if len(parts) > 2 else parts[1]  # path/to/file.json
-        else:
-            # Handle s3:// format
-            uri_parts = transcript_uri.replace('s3://', '').split('/', 1)
-            bucket = uri_parts[0]
-            key = uri_parts[1] if len(uri_parts) > 1 else ''
+        bucket, key = parse_s3_uri(transcript_uri)
         
         logger.info(f"Downloading transcription from bucket: {bucket}, key: {key}")
         
-        # Download transcription file
-        response = s3_client.get_object(Bucket=bucket, Key=key)
-        transcript_data = json.loads(response['Body'].read().decode('utf-8'))
+        response = get_client('s3').get_object(Bucket=bucket, Key=key)
         
-        # Extract transcript text
-        transcript_text = transcript_data['results']['transcripts'][0]['transcript']
+        if ijson is not None:
+            # Stream the body and stop at the transcript, skipping the much
+            # larger items section (speaker labels, alternatives)
+            with response['Body'] as body:
+                transcript_text = next(ijson.items(body, 'results.transcripts.item.transcript'))
+        else:
+            transcript_data = load_json(response['Body'].read())
+            transcript_text = transcript_data['results']['transcripts'][0]['transcript']
         
         logger.info(f"Downloaded transcription: {len(transcript_text)} characters")
         return transcript_text
@@ -195,7 +251,7 @@ def process_transcription_with_nlp(transcription_text: str, original_key: str) -
         'timestamp': datetime.utcnow().isoformat(),
         'processing_id': str(uuid.uuid4()),
         'original_audio_file': original_key,
-        'transcription_text': transcription_text,
+        'transcription_length': len(transcription_text),
         'entities': [],
         'phi_entities': [],
         'medications': [],
@@ -206,19 +262,15 @@ def process_transcription_with_nlp(transcription_text: str, original_key: str) -
     }
     
     try:
-        # Detect medical entities
-        entity_response = comprehend_medical.detect_entities_v2(Text=transcription_text)
-        results['entities'] = entity_response.get('Entities', [])
-        
-        # Detect PHI
-        phi_response = comprehend_medical.detect_phi(Text=transcription_text)
-        results['phi_entities'] = phi_response.get('Entities', [])
+        # Detect medical entities and PHI; long transcripts are sent as
+        # concurrent chunks
+        results['entities'], results['phi_entities'] = detect_entities_and_phi(transcription_text)
         
         # Process and categorize entities
         categorize_transcription_entities(results)
         
         # Extract cath lab specific information
-        extract_cath_lab_entities(results)
+        extract_cath_lab_entities(results, transcription_text)
         
         logger.info(f"Processed transcription with {len(results['entities'])} entities")
         
@@ -230,127 +282,95 @@ def process_transcription_with_nlp(transcription_text: str, original_key: str) -
 
 def categorize_transcription_entities(results: Dict[str, Any]) -> None:
     """
-    Categorize entities from transcription into relevant categories
+    Categorize entities from transcription into relevant categories,
+    and flag cardiovascular entities in the same pass
     """
+    categories = {
+        'MEDICATION': results['medications'],
+        'MEDICAL_CONDITION': results['diagnoses'],
+        'PROCEDURE': results['procedures']
+    }
+    cardiovascular_entities = results['cardiovascular_entities']
+    
     for entity in results['entities']:
-        category = entity.get('Category', '').upper()
-        entity_type = entity.get('Type', '').upper()
-        text = entity.get('Text', '').lower()
-        
-        if category == 'MEDICATION':
-            results['medications'].append({
-                'text': entity.get('Text'),
-                'confidence': entity.get('Score'),
-                'type': entity_type,
-                'attributes': entity.get('Attributes', []),
-                'source': 'audio_transcription'
-            })
+        text = entity.get('Text', '')
+        score = entity.get('Score')
+        category = entity.get('Category', '')
+        entity_type = entity.get('Type', '')
         
-        elif category == 'MEDICAL_CONDITION':
-            results['diagnoses'].append({
-                'text': entity.get('Text'),
-                'confidence': entity.get('Score'),
-                'type': entity_type,
+        category_list = categories.get(category.upper())
+        if category_list is not None:
+            category_list.append({
+                'text': text,
+                'confidence': score,
+                'type': entity_type.upper(),
                 'attributes': entity.get('Attributes', []),
                 'source': 'audio_transcription'
             })
         
-        elif category == 'PROCEDURE':
-            results['procedures'].append({
-                'text': entity.get('Text'),
-                'confidence': entity.get('Score'),
+        if CARDIO_KEYWORD_RE.search(text.lower()):
+            cardiovascular_entities.append({
+                'text': text,
+                'confidence': score,
+                'category': category,
                 'type': entity_type,
-                'attributes': entity.get('Attributes', []),
+                'begin_offset': entity.get('BeginOffset'),
+                'end_offset': entity.get('EndOffset'),
                 'source': 'audio_transcription'
             })
 
-def extract_cath_lab_entities(results: Dict[str, Any]) -> None:
+def extract_cath_lab_entities(results: Dict[str, Any], transcription_text: str) -> None:
     """
-    Extract cath lab specific entities and cardiovascular information
+    Extract cath lab specific entities from the transcript
     """
-    # Cath lab specific terms
-    cath_lab_terms = [
-        'catheter', 'guidewire', 'balloon', 'stent', 'contrast',
-        'fluoroscopy', 'angiography', 'hemodynamics', 'pressure',
-        'injection', 'vessel', 'artery', 'coronary', 'lad', 'rca', 'lcx',
-        'stenosis', 'occlusion', 'thrombus', 'dissection',
-        'complications', 'bleeding', 'hematoma', 'perforation',
-        'access site', 'femoral', 'radial', 'closure device',
-        'procedure time', 'contrast volume', 'radiation dose'
-    ]
-    
-    # Cardiovascular procedures specific to cath lab
-    cath_procedures = [
-        'angioplasty', 'ptca', 'pci', 'stenting', 'atherectomy',
-        'thrombectomy', 'balloon angioplasty', 'drug eluting stent',
-        'bare metal stent', 'rotablation', 'cutting balloon',
-        'intravascular ultrasound', 'ivus', 'oct', 'ffr',
-        'fractional flow reserve', 'instantaneous wave free ratio'
-    ]
+    # Extract cath lab specific entities in one pass over the transcript.
+    # Non-ASCII characters are replaced rather than dropped so byte positions
+    # still line up with the text.
+    transcription_text = transcription_text.lower()
+    transcript_bytes = transcription_text.encode('ascii', 'replace')
     
-    # Extract cath lab specific entities
-    transcription_text = results['transcription_text'].lower()
-    
-    for term in cath_lab_terms + cath_procedures:
-        if term in transcription_text:
-            # Find all occurrences
-            start_pos = 0
-            while True:
-                pos = transcription_text.find(term, start_pos)
-                if pos == -1:
-                    break
-                
+    for match in CATH_TERM_START_RE.finditer(transcript_bytes):
+        pos = match.start()
+        for term_bytes in CATH_TERMS_BY_INITIAL[transcript_bytes[pos]]:
+            if transcript_bytes.startswith(term_bytes, pos):
+                term = CATH_TERM_BYTES[term_bytes]
                 results['cath_lab_specific'].append({
                     'text': term,
-                    'category': 'cath_lab_equipment' if term in cath_lab_terms else 'cath_lab_procedure',
+                    'category': CATH_TERM_CATEGORIES[term],
                     'position': pos,
                     'context': transcription_text[max(0, pos-50):pos+len(term)+50],
                     'source': 'audio_transcription'
                 })
-                
-                start_pos = pos + 1
-    
-    # Also check existing entities for cardiovascular relevance
-    cardio_keywords = [
-        'coronary', 'cardiac', 'heart', 'cardiovascular', 'vessel',
-        'artery', 'stenosis', 'ischemia', 'myocardial', 'angina'
-    ]
-    
-    for entity in results['entities']:
-        entity_text = entity.get('Text', '').lower()
-        if any(keyword in entity_text for keyword in cardio_keywords):
-            results['cardiovascular_entities'].append({
-                'text': entity.get('Text'),
-                'confidence': entity.get('Score'),
-                'category': entity.get('Category'),
-                'type': entity.get('Type'),
-                'begin_offset': entity.get('BeginOffset'),
-                'end_offset': entity.get('EndOffset'),
-                'source': 'audio_transcription'
-            })
 
-def save_transcription_results(results: Dict[str, Any], original_key: str) -> None:
+def save_transcription_results(results: Dict[str, Any], original_key: str, transcription_text: str) -> None:
     """
     Save transcription and NLP results to S3
     """
     try:
         output_bucket = os.environ['NLP_OUTPUT_BUCKET']
+        s3_client = get_client('s3')
         
-        # Save detailed results
-        output_key = f"transcriptions/{original_key.replace('.wav', '_transcription_results.json').replace('.mp3', '_transcription_results.json')}"
+        base = os.path.splitext(original_key)[0]
+        text_key = f"transcriptions/{base}_text.txt"
+        output_key = f"transcriptions/{base}_transcription_results.json"
+        summary_key = f"transcriptions/summaries/{base}_summary.json"
         
+        # Store the transcript once, on its own, and reference it from the
+        # results; it is written first since the results object triggers
+        # FHIR resource creation, which reads it back
         s3_client.put_object(
             Bucket=output_bucket,
-            Key=output_key,
-            Body=json.dumps(results, indent=2),
-            ContentType='application/json'
+            Key=text_key,
+            Body=transcription_text.encode('utf-8'),
+            ContentType='text/plain'
         )
+        results['transcription_text_uri'] = f"s3://{output_bucket}/{text_key}"
         
-        # Save summary for quick access
+        # Detailed results, plus a summary for quick access
         summary = {
             'timestamp': results['timestamp'],
             'original_file': original_key,
-            'transcription_length': len(results['transcription_text']),
+            'transcription_length': results['transcription_length'],
             'total_entities': len(results['entities']),
             'cardiovascular_entities': len(results['cardiovascular_entities']),
             'cath_lab_entities': len(results['cath_lab_specific']),
@@ -359,15 +379,29 @@ def save_transcription_results(results: Dict[str, Any], original_key: str) -> No
             'diagnoses_found': len(results['diagnoses'])
         }
         
-        summary_key = f"transcriptions/summaries/{original_key.replace('.wav', '_summary.json').replace('.mp3', '_summary.json')}"
-        
-        s3_client.put_object(
-            Bucket=output_bucket,
-            Key=summary_key,
-            Body=json.dumps(summary, indent=2),
-            ContentType='application/json'
+        # The detailed results are mostly repetitive JSON text, so they are
+        # stored gzip-compressed; the small summary stays plain
+        objects = (
+            (output_key, gzip.compress(dump_json(results), compresslevel=3), {'ContentEncoding': 'gzip'}),
+            (summary_key, dump_json(summary), {})
         )
         
+        # Upload both objects concurrently
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            uploads = [
+                executor.submit(
+                    s3_client.put_object,
+                    Bucket=output_bucket,
+                    Key=key,
+                    Body=body,
+                    ContentType='application/json',
+                    **extra_args
+                )
+                for key, body, extra_args in objects
+            ]
+            for upload in uploads:
+                upload.result()
+        
         logger.info(f"Transcription results saved to: {output_key}")
         logger.info(f"Summary saved to: {summary_key}")
         
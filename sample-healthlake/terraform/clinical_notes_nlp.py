@@ -1,19 +1,60 @@
 import json
-import boto3
+import re
 import urllib.parse
 import logging
-from typing import Dict, List, Any
+from typing import Dict, Any, Optional
 import uuid
 from datetime import datetime
 import os
 
+from comprehend_medical import get_client, dump_json, detect_entities_and_phi
+
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize AWS clients
-comprehend_medical = boto3.client('comprehendmedical')
-s3_client = boto3.client('s3')
+# Cardiovascular-related terms
+CARDIO_MEDICATIONS = (
+    'statin', 'atorvastatin', 'simvastatin', 'rosuvastatin',
+    'beta-blocker', 'metoprolol', 'carvedilol', 'atenolol',
+    'ace inhibitor', 'lisinopril', 'enalapril', 'captopril',
+    'arb', 'losartan', 'valsartan', 'telmisartan',
+    'calcium channel blocker', 'amlodipine', 'diltiazem',
+    'diuretic', 'furosemide', 'hydrochlorothiazide',
+    'anticoagulant', 'warfarin', 'apixaban', 'rivaroxaban',
+    'antiplatelet', 'aspirin', 'clopidogrel', 'prasugrel'
+)
+
+CARDIO_PROCEDURES = (
+    'angioplasty', 'stent', 'stenting', 'catheterization',
+    'cardiac catheterization', 'cath lab', 'pci',
+    'percutaneous coronary intervention', 'cabg',
+    'coronary artery bypass', 'valve replacement',
+    'angiogram', 'coronary angiography', 'echocardiogram',
+    'stress test', 'ekg', 'electrocardiogram',
+    'holter monitor', 'cardiac mri', 'ct angiography'
+)
+
+CARDIO_CONDITIONS = (
+    'coronary artery disease', 'cad', 'myocardial infarction',
+    'heart attack', 'angina', 'chest pain', 'arrhythmia',
+    'atrial fibrillation', 'heart failure', 'chf',
+    'hypertension', 'high blood pressure', 'hyperlipidemia',
+    'high cholesterol', 'atherosclerosis', 'stenosis',
+    'valve disease', 'cardiomyopathy', 'pericarditis',
+    'endocarditis', 'aortic stenosis', 'mitral regurgitation'
+)
+
+# One compiled alternation per category, checked in priority order
+# (medication, procedure, condition); built once per container
+CARDIO_TERM_PATTERNS = tuple(
+    (re.compile('|'.join(map(re.escape, terms))), cardio_type)
+    for terms, cardio_type in (
+        (CARDIO_MEDICATIONS, 'cardiovascular_medication'),
+        (CARDIO_PROCEDURES, 'cardiovascular_procedure'),
+        (CARDIO_CONDITIONS, 'cardiovascular_condition')
+    )
+)
 
 def handler(event, context):
     """
@@ -28,20 +69,22 @@ def handler(event, context):
         logger.info(f"Processing file: {key} from bucket: {bucket}")
         
         # Read the clinical note from S3
-        response = s3_client.get_object(Bucket=bucket, Key=key)
+        response = get_client('s3').get_object(Bucket=bucket, Key=key)
         clinical_text = response['Body'].read().decode('utf-8')
         
         # Process with Comprehend Medical
         nlp_results = process_clinical_text(clinical_text)
         
-        # Save results to output bucket
+        # Save results to output bucket, partitioned by date so the newest
+        # results sort last within a day's prefix
         output_bucket = os.environ['NLP_OUTPUT_BUCKET']
-        output_key = f"processed/{key.replace('.txt', '_processed.json')}"
+        base = os.path.splitext(key)[0].replace('/', '_')
+        output_key = f"processed/{datetime.utcnow():%Y/%m/%d/%H%M%S}_{base}_processed.json"
         
-        s3_client.put_object(
+        get_client('s3').put_object(
             Bucket=output_bucket,
             Key=output_key,
-            Body=json.dumps(nlp_results, indent=2),
+            Body=dump_json(nlp_results),
             ContentType='application/json'
         )
         
@@ -79,20 +122,12 @@ def process_clinical_text(text: str) -> Dict[str, Any]:
     }
     
     try:
-        # Detect medical entities
-        entity_response = comprehend_medical.detect_entities_v2(Text=text)
-        results['entities'] = entity_response.get('Entities', [])
+        # Detect medical entities and PHI
+        results['entities'], results['phi_entities'] = detect_entities_and_phi(text)
         
-        # Detect PHI
-        phi_response = comprehend_medical.detect_phi(Text=text)
-        results['phi_entities'] = phi_response.get('Entities', [])
-        
-        # Process and categorize entities
+        # Categorize entities and extract cardiovascular-specific information
         categorize_entities(results)
         
-        # Extract cardiovascular-specific information
-        extract_cardiovascular_entities(results)
-        
         logger.info(f"Processed {len(results['entities'])} entities")
         
     except Exception as e:
@@ -103,98 +138,49 @@ def process_clinical_text(text: str) -> Dict[str, Any]:
 
 def categorize_entities(results: Dict[str, Any]) -> None:
     """
-    Categorize entities into medications, procedures, and diagnoses
-    """
-    for entity in results['entities']:
-        category = entity.get('Category', '').upper()
-        entity_type = entity.get('Type', '').upper()
-        text = entity.get('Text', '').lower()
-        
-        if category == 'MEDICATION':
-            results['medications'].append({
-                'text': entity.get('Text'),
-                'confidence': entity.get('Score'),
-                'type': entity_type,
-                'attributes': entity.get('Attributes', [])
-            })
-        
-        elif category == 'MEDICAL_CONDITION':
-            results['diagnoses'].append({
-                'text': entity.get('Text'),
-                'confidence': entity.get('Score'),
-                'type': entity_type,
-                'attributes': entity.get('Attributes', [])
-            })
-        
-        elif category == 'PROCEDURE':
-            results['procedures'].append({
-                'text': entity.get('Text'),
-                'confidence': entity.get('Score'),
-                'type': entity_type,
-                'attributes': entity.get('Attributes', [])
-            })
-
-def extract_cardiovascular_entities(results: Dict[str, Any]) -> None:
-    """
-    Extract and flag cardiovascular-specific entities
+    Categorize entities into medications, procedures, and diagnoses,
+    and flag cardiovascular-specific entities in the same pass
     """
-    # Cardiovascular-related terms
-    cardio_medications = [
-        'statin', 'atorvastatin', 'simvastatin', 'rosuvastatin',
-        'beta-blocker', 'metoprolol', 'carvedilol', 'atenolol',
-        'ace inhibitor', 'lisinopril', 'enalapril', 'captopril',
-        'arb', 'losartan', 'valsartan', 'telmisartan',
-        'calcium channel blocker', 'amlodipine', 'diltiazem',
-        'diuretic', 'furosemide', 'hydrochlorothiazide',
-        'anticoagulant', 'warfarin', 'apixaban', 'rivaroxaban',
-        'antiplatelet', 'aspirin', 'clopidogrel', 'prasugrel'
-    ]
-    
-    cardio_procedures = [
-        'angioplasty', 'stent', 'stenting', 'catheterization',
-        'cardiac catheterization', 'cath lab', 'pci',
-        'percutaneous coronary intervention', 'cabg',
-        'coronary artery bypass', 'valve replacement',
-        'angiogram', 'coronary angiography', 'echocardiogram',
-        'stress test', 'ekg', 'electrocardiogram',
-        'holter monitor', 'cardiac mri', 'ct angiography'
-    ]
+    categories = {
+        'MEDICATION': results['medications'],
+        'MEDICAL_CONDITION': results['diagnoses'],
+        'PROCEDURE': results['procedures']
+    }
     
-    cardio_conditions = [
-        'coronary artery disease', 'cad', 'myocardial infarction',
-        'heart attack', 'angina', 'chest pain', 'arrhythmia',
-        'atrial fibrillation', 'heart failure', 'chf',
-        'hypertension', 'high blood pressure', 'hyperlipidemia',
-        'high cholesterol', 'atherosclerosis', 'stenosis',
-        'valve disease', 'cardiomyopathy', 'pericarditis',
-        'endocarditis', 'aortic stenosis', 'mitral regurgitation'
-    ]
+    cardiovascular_entities = results['cardiovascular_entities']
     
-    # Check all entities for cardiovascular relevance
     for entity in results['entities']:
-        entity_text = entity.get('Text', '').lower()
+        text = entity.get('Text', '')
+        score = entity.get('Score')
         category = entity.get('Category', '').upper()
+        attributes = entity.get('Attributes', [])
+        
+        category_list = categories.get(category)
+        if category_list is not None:
+            category_list.append({
+                'text': text,
+                'confidence': score,
+                'type': entity.get('Type', '').upper(),
+                'attributes': attributes
+            })
         
-        is_cardio = False
-        cardio_type = None
-        
-        if any(term in entity_text for term in cardio_medications):
-            is_cardio = True
-            cardio_type = 'cardiovascular_medication'
-        elif any(term in entity_text for term in cardio_procedures):
-            is_cardio = True
-            cardio_type = 'cardiovascular_procedure'
-        elif any(term in entity_text for term in cardio_conditions):
-            is_cardio = True
-            cardio_type = 'cardiovascular_condition'
-        
-        if is_cardio:
-            results['cardiovascular_entities'].append({
-                'text': entity.get('Text'),
-                'confidence': entity.get('Score'),
+        cardio_type = get_cardiovascular_type(text.lower())
+        if cardio_type:
+            cardiovascular_entities.append({
+                'text': text,
+                'confidence': score,
                 'category': category,
                 'cardiovascular_type': cardio_type,
                 'begin_offset': entity.get('BeginOffset'),
                 'end_offset': entity.get('EndOffset'),
-                'attributes': entity.get('Attributes', [])
-            })
\ No newline at end of file
+                'attributes': attributes
+            })
+
+def get_cardiovascular_type(entity_text: str) -> Optional[str]:
+    """
+    Get the cardiovascular type of lowercased entity text, if any
+    """
+    for pattern, cardio_type in CARDIO_TERM_PATTERNS:
+        if pattern.search(entity_text):
+            return cardio_type
+    return None
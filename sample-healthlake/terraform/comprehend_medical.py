@@ -0,0 +1,133 @@
+import json
+import boto3
+from botocore.config import Config
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import re
+from typing import Dict, List, Any, Tuple
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# AWS clients are created lazily and cached per container, with keep-alive
+# and adaptive retries so warm invocations reuse the HTTPS connection pool
+CLIENT_CONFIG = Config(
+    tcp_keepalive=True,
+    max_pool_connections=25,
+    retries={'mode': 'adaptive', 'max_attempts': 5}
+)
+
+# Comprehend Medical throttles near its quota once chunks are sent
+# concurrently, so give it more attempts under the adaptive rate limiter
+SERVICE_CONFIGS = {
+    'comprehendmedical': CLIENT_CONFIG.merge(Config(
+        retries={'mode': 'adaptive', 'max_attempts': 10}
+    ))
+}
+
+# Concurrent Comprehend Medical calls per document (one per text chunk)
+NLP_MAX_WORKERS = 8
+
+@lru_cache(maxsize=None)
+def get_client(service_name: str):
+    """
+    Get a cached boto3 client for the given service
+    """
+    return boto3.client(service_name, config=SERVICE_CONFIGS.get(service_name, CLIENT_CONFIG))
+
+def load_json(data: bytes) -> Any:
+    """
+    Parse JSON bytes, with orjson when it is packaged
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dump_json(obj: Any) -> bytes:
+    """
+    Serialize to indented JSON bytes, with orjson when it is packaged
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, indent=2).encode('utf-8')
+
+def detect_entities_and_phi(text: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Detect medical entities and PHI with Comprehend Medical.
+    PHI comes from the PROTECTED_HEALTH_INFORMATION entities of DetectEntitiesV2
+    unless ENABLE_PHI_SEPARATE is true, in which case DetectPHI runs concurrently
+    """
+    comprehend_medical = get_client('comprehendmedical')
+    separate_phi = os.environ.get('ENABLE_PHI_SEPARATE', 'false').lower() == 'true'
+    
+    # Each call accepts at most 20,000 bytes, so longer text is sent as
+    # concurrent sentence-aligned chunks and the offsets stitched back together
+    chunks = chunk_text(text)
+    
+    with ThreadPoolExecutor(max_workers=NLP_MAX_WORKERS) as executor:
+        entity_futures = [
+            (offset, executor.submit(comprehend_medical.detect_entities_v2, Text=chunk))
+            for offset, chunk in chunks
+        ]
+        phi_futures = [
+            (offset, executor.submit(comprehend_medical.detect_phi, Text=chunk))
+            for offset, chunk in chunks
+        ] if separate_phi else []
+        
+        entities = collect_chunk_entities(entity_futures)
+        phi_entities = collect_chunk_entities(phi_futures)
+    
+    if not separate_phi:
+        phi_entities = [entity for entity in entities if entity.get('Category') == 'PROTECTED_HEALTH_INFORMATION']
+    
+    return entities, phi_entities
+
+def chunk_text(text: str, max_bytes: int = 18000) -> List[Tuple[int, str]]:
+    """
+    Split text on sentence boundaries into (offset, chunk) pairs whose UTF-8
+    size stays within max_bytes
+    """
+    pieces = []
+    for sentence in re.split(r'(?<=\. )', text):
+        if len(sentence.encode('utf-8')) <= max_bytes:
+            pieces.append(sentence)
+        else:
+            # A single oversized sentence is cut assuming 4 bytes per character
+            step = max_bytes // 4
+            pieces.extend(sentence[i:i + step] for i in range(0, len(sentence), step))
+    
+    chunks = []
+    chunk_start = 0
+    chunk_bytes = 0
+    pos = 0
+    for piece in pieces:
+        piece_bytes = len(piece.encode('utf-8'))
+        if chunk_bytes and chunk_bytes + piece_bytes > max_bytes:
+            chunks.append((chunk_start, text[chunk_start:pos]))
+            chunk_start = pos
+            chunk_bytes = 0
+        pos += len(piece)
+        chunk_bytes += piece_bytes
+    chunks.append((chunk_start, text[chunk_start:pos]))
+    
+    return chunks
+
+def collect_chunk_entities(futures: List[Tuple[int, Any]]) -> List[Dict[str, Any]]:
+    """
+    Gather entities from per-chunk Comprehend Medical calls, shifting their
+    offsets from chunk-relative to text-relative
+    """
+    entities = []
+    for offset, future in futures:
+        chunk_entities = future.result().get('Entities', [])
+        if offset:
+            for entity in chunk_entities:
+                for item in [entity] + entity.get('Attributes', []):
+                    if 'BeginOffset' in item:
+                        item['BeginOffset'] += offset
+                        item['EndOffset'] += offset
+        entities.extend(chunk_entities)
+    return entities
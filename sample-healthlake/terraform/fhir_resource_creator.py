@@ -1,29 +1,246 @@
+import gzip
+import hashlib
+import hmac
 import json
 import boto3
 import logging
 import uuid
-from datetime import datetime, timezone
-from typing import Dict, List, Any, Optional
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Any, Iterator, Optional
+from collections import Counter
+from itertools import chain, islice
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import os
 import urllib3
 import base64
 from botocore.auth import SigV4Auth
 from botocore.awsrequest import AWSRequest
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# First run of digits in AGE PHI text, e.g. '67-year-old'
+AGE_RE = re.compile(r'\d+')
+
+# Most resources created from one set of NLP results: Patient,
+# DocumentReference, 5 Observations, 3 MedicationStatements, 3 Conditions
+MAX_RESOURCES_PER_RESULT = 13
+
+# NLP result lists that become clinical resources linked to the Patient
+FINDING_KEYS = ('cardiovascular_entities', 'medications', 'diagnoses')
+
+# NLP results at least this large are parsed from the S3 stream (when ijson
+# is packaged) rather than read into memory whole first
+STREAM_PARSE_MIN_BYTES = 4 * 1024 * 1024
+
+def load_json(data: bytes) -> Any:
+    """
+    Parse JSON bytes, with orjson when it is packaged
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dump_json(obj: Any) -> bytes:
+    """
+    Serialize to compact JSON bytes, with orjson when it is packaged
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+def generate_uuids(count: int) -> List[str]:
+    """
+    Generate count random (version 4) UUIDs from a single os.urandom call
+    """
+    raw = os.urandom(16 * count)
+    return [str(uuid.UUID(bytes=raw[i:i + 16], version=4)) for i in range(0, 16 * count, 16)]
+
 def get_fhir_datetime() -> str:
     """
     Get properly formatted FHIR datetime with timezone
     """
     return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
 
+class CachedKeySigV4Auth(SigV4Auth):
+    """
+    SigV4 signer that derives the signing key once per day and secret key,
+    instead of running the four key-derivation HMACs for every request
+    """
+    def __init__(self, credentials, service_name, region_name):
+        super().__init__(credentials, service_name, region_name)
+        # (secret key, datestamp) -> signing key, held as one tuple so threads
+        # signing concurrently always see a matching pair
+        self._cached_signing_key = (None, None)
+    
+    def signature(self, string_to_sign, request):
+        secret_key = self.credentials.secret_key
+        scope = (secret_key, request.context['timestamp'][0:8])
+        
+        cached_scope, signing_key = self._cached_signing_key
+        if cached_scope != scope:
+            signing_key = f"AWS4{secret_key}".encode('utf-8')
+            for part in (scope[1], self._region_name, self._service_name, 'aws4_request'):
+                signing_key = hmac.new(signing_key, part.encode('utf-8'), hashlib.sha256).digest()
+            self._cached_signing_key = (scope, signing_key)
+        
+        return hmac.new(signing_key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+
 # Initialize AWS clients
 s3_client = boto3.client('s3')
-session = boto3.Session()
-credentials = session.get_credentials()
+
+# HealthLake FHIR API settings. The connection pool and request signer are
+# created on the first HealthLake request and reused by warm invocations.
+# Individual PUTs use a bounded number of workers to stay under the
+# datastore's request rate, and throttled requests are retried with backoff.
+HEALTHLAKE_MAX_WORKERS = 10
+HEALTHLAKE_RETRY = urllib3.util.Retry(
+    total=3,
+    backoff_factor=0.3,
+    status_forcelist=[429, 503],
+    allowed_methods=frozenset(['PUT', 'POST']),
+    raise_on_status=False
+)
+
+HEALTHLAKE_ENDPOINT = os.environ.get('HEALTHLAKE_ENDPOINT', '')
+DATASTORE_ID = os.environ.get('DATASTORE_ID')
+NLP_OUTPUT_BUCKET = os.environ.get('NLP_OUTPUT_BUCKET')
+
+# Remove '/datastore/{id}' from endpoint if present and add it back
+FHIR_BASE_URL = f"{HEALTHLAKE_ENDPOINT.split('/datastore/')[0]}/datastore/{DATASTORE_ID}/r4"
+
+# HealthLake error bodies (OperationOutcome) are truncated to this many bytes
+# before decoding for logs and responses
+MAX_ERROR_BODY_BYTES = 4096
+
+FHIR_HEADERS = {
+    'Content-Type': 'application/fhir+json',
+    'Accept': 'application/fhir+json'
+}
+
+# Codings shared by every resource of a kind. Resources reference these
+# rather than copies; they are only ever serialized, never modified.
+def nlp_tag_meta(code: str, display: str) -> Dict[str, Any]:
+    """
+    Build the meta section tagging a resource as created from NLP results
+    """
+    return {
+        'tag': [{
+            'system': 'http://gocathlab.com/fhir/tags',
+            'code': code,
+            'display': display
+        }]
+    }
+
+PATIENT_META = nlp_tag_meta('nlp-extracted', 'NLP Extracted Patient')
+DOCUMENT_META = nlp_tag_meta('nlp-source', 'NLP Source Document')
+OBSERVATION_META = nlp_tag_meta('nlp-extracted', 'NLP Extracted')
+MEDICATION_META = nlp_tag_meta('nlp-extracted', 'NLP Extracted Medication')
+PROCEDURE_META = nlp_tag_meta('nlp-extracted', 'NLP Extracted Procedure')
+CONDITION_META = nlp_tag_meta('nlp-extracted', 'NLP Extracted Condition')
+
+MEDICAL_RECORD_NUMBER_TYPE = {
+    'coding': [{
+        'system': 'http://terminology.hl7.org/CodeSystem/v2-0203',
+        'code': 'MR',
+        'display': 'Medical Record Number'
+    }]
+}
+
+PROGRESS_NOTE_TYPE = {
+    'coding': [{
+        'system': 'http://loinc.org',
+        'code': '11506-3',
+        'display': 'Progress note'
+    }]
+}
+
+MIME_TYPE_SUFFICIENT_FORMAT = {
+    'system': 'http://ihe.net/fhir/ihe.formatcode.fhir/CodeSystem/formatcode',
+    'code': 'urn:ihe:iti:xds:2017:mimeTypeSufficient',
+    'display': 'mimeType Sufficient'
+}
+
+SURVEY_CATEGORY = [{
+    'coding': [{
+        'system': 'http://terminology.hl7.org/CodeSystem/observation-category',
+        'code': 'survey',
+        'display': 'Survey'
+    }]
+}]
+
+CLINICAL_FINDING_CODING = [{
+    'system': 'http://snomed.info/sct',
+    'code': '404684003',
+    'display': 'Clinical finding'
+}]
+
+CONDITION_ACTIVE_STATUS = {
+    'coding': [{
+        'system': 'http://terminology.hl7.org/CodeSystem/condition-clinical',
+        'code': 'active',
+        'display': 'Active'
+    }]
+}
+
+CONDITION_UNCONFIRMED_STATUS = {
+    'coding': [{
+        'system': 'http://terminology.hl7.org/CodeSystem/condition-ver-status',
+        'code': 'unconfirmed',
+        'display': 'Unconfirmed'
+    }]
+}
+
+def read_error_body(response: urllib3.HTTPResponse) -> str:
+    """
+    Decode at most MAX_ERROR_BODY_BYTES of an error response body
+    """
+    if not response.data:
+        return 'Unknown error'
+    return response.data[:MAX_ERROR_BODY_BYTES].decode('utf-8', 'replace')
+
+@lru_cache(maxsize=None)
+def get_healthlake_http() -> urllib3.PoolManager:
+    """
+    Get the cached connection pool for the HealthLake FHIR API
+    """
+    return urllib3.PoolManager(num_pools=4, maxsize=HEALTHLAKE_MAX_WORKERS, retries=HEALTHLAKE_RETRY)
+
+@lru_cache(maxsize=None)
+def get_healthlake_signer() -> CachedKeySigV4Auth:
+    """
+    Get the cached SigV4 signer for the HealthLake FHIR API
+    """
+    session = boto3.Session()
+    return CachedKeySigV4Auth(session.get_credentials(), 'healthlake', session.region_name)
+
+def send_fhir_request(method: str, url: str, body: bytes) -> urllib3.HTTPResponse:
+    """
+    Send a SigV4-signed request to the HealthLake FHIR API
+    """
+    # Only the signature headers are computed per request
+    request = AWSRequest(method=method, url=url, data=body, headers=FHIR_HEADERS)
+    get_healthlake_signer().add_auth(request)
+    
+    return get_healthlake_http().request(
+        method=method,
+        url=url,
+        body=body,
+        headers=dict(request.headers)
+    )
 
 def handler(event, context):
     """
@@ -48,8 +265,14 @@ def handler(event, context):
             logger.warning("No NLP results found to process")
             return {'statusCode': 200, 'body': 'No results to process'}
         
-        # Create FHIR resources
-        fhir_resources = create_fhir_resources_from_nlp(nlp_results)
+        # A Patient and DocumentReference alone are not worth a HealthLake write
+        if not any(nlp_results.get(finding_key) for finding_key in FINDING_KEYS):
+            logger.info("No clinical findings in NLP results, skipping HealthLake")
+            return {'statusCode': 200, 'body': 'No clinical findings to store'}
+        
+        # Create FHIR resources, all stamped with the same time
+        now_iso = get_fhir_datetime()
+        fhir_resources = create_fhir_resources_from_nlp(nlp_results, now_iso)
         
         # Store resources in HealthLake
         healthlake_responses = store_resources_in_healthlake(fhir_resources)
@@ -76,8 +299,23 @@ def load_nlp_results_from_s3(bucket: str, key: str) -> Dict[str, Any]:
     """
     try:
         response = s3_client.get_object(Bucket=bucket, Key=key)
-        nlp_results = json.loads(response['Body'].read().decode('utf-8'))
-        logger.info(f"Loaded NLP results from {key}")
+        
+        # Transcription results are stored gzip-compressed
+        compressed = response.get('ContentEncoding') == 'gzip'
+        
+        if ijson is not None and response.get('ContentLength', 0) >= STREAM_PARSE_MIN_BYTES:
+            # Build the results one top-level key at a time from the stream,
+            # so the raw payload is never held alongside the parsed dict
+            with response['Body'] as body:
+                stream = gzip.GzipFile(fileobj=body) if compressed else body
+                nlp_results = dict(ijson.kvitems(stream, '', use_float=True))
+        else:
+            body = response['Body'].read()
+            if compressed:
+                body = gzip.decompress(body)
+            nlp_results = load_json(body)
+        
+        logger.info("Loaded NLP results from %s", key)
         return nlp_results
     except Exception as e:
         logger.error(f"Error loading NLP results: {str(e)}")
@@ -88,19 +326,21 @@ def get_latest_nlp_results() -> Dict[str, Any]:
     Get the latest NLP results from the output bucket
     """
     try:
-        bucket = os.environ['NLP_OUTPUT_BUCKET']
+        bucket = NLP_OUTPUT_BUCKET
+        paginator = s3_client.get_paginator('list_objects_v2')
+        today = datetime.now(timezone.utc)
         
-        # List recent objects in the processed folder
-        response = s3_client.list_objects_v2(
-            Bucket=bucket,
-            Prefix='processed/',
-            MaxKeys=10
-        )
-        
-        if 'Contents' in response:
-            # Get the most recent file
-            latest_object = max(response['Contents'], key=lambda x: x['LastModified'])
-            return load_nlp_results_from_s3(bucket, latest_object['Key'])
+        # Results are stored under processed/YYYY/MM/DD/HHMMSS_..., so only
+        # today's partition is listed (or yesterday's just after midnight)
+        # and the last key in it is the most recent file
+        for day in (today, today - timedelta(days=1)):
+            latest_key = None
+            for page in paginator.paginate(Bucket=bucket, Prefix=f"processed/{day:%Y/%m/%d}/"):
+                if page.get('Contents'):
+                    latest_key = page['Contents'][-1]['Key']
+            
+            if latest_key:
+                return load_nlp_results_from_s3(bucket, latest_key)
         
         return {}
         
@@ -108,40 +348,54 @@ def get_latest_nlp_results() -> Dict[str, Any]:
         logger.error(f"Error getting latest NLP results: {str(e)}")
         return {}
 
-def create_fhir_resources_from_nlp(nlp_results: Dict[str, Any]) -> List[Dict[str, Any]]:
+def load_source_text(nlp_results: Dict[str, Any]) -> str:
+    """
+    Get the source text of NLP results; audio transcriptions are stored
+    separately in S3 and referenced by transcription_text_uri
+    """
+    text_uri = nlp_results.get('transcription_text_uri')
+    if text_uri:
+        bucket, key = text_uri[len('s3://'):].split('/', 1)
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        return response['Body'].read().decode('utf-8')
+    
+    return nlp_results.get('original_text', nlp_results.get('transcription_text', ''))
+
+def create_fhir_resources_from_nlp(nlp_results: Dict[str, Any], now_iso: str) -> List[Dict[str, Any]]:
     """
     Create FHIR resources from NLP processing results
     """
-    fhir_resources = []
+    resource_ids = iter(generate_uuids(MAX_RESOURCES_PER_RESULT))
     
     # Step 1: Extract patient info from PHI entities and create Patient resource
-    patient_resource = create_patient_from_phi(nlp_results)
-    fhir_resources.append(patient_resource)
-    
+    patient_resource = create_patient_from_phi(nlp_results, next(resource_ids))
     patient_id = patient_resource['id']
     
     # Step 2: Create DocumentReference for the source text
-    document_ref = create_document_reference(nlp_results, patient_id)
-    fhir_resources.append(document_ref)
+    document_ref = create_document_reference(nlp_results, patient_id, now_iso, resource_ids)
+    
+    resource_groups = [[patient_resource, document_ref]]
     
     # Step 3: Create medical findings linked to this patient
-    observations = create_cardiovascular_observations(nlp_results, patient_id)
-    fhir_resources.extend(observations)
+    if nlp_results.get('cardiovascular_entities'):
+        resource_groups.append(create_cardiovascular_observations(nlp_results, patient_id, now_iso, resource_ids))
     
-    medication_statements = create_medication_statements(nlp_results, patient_id)
-    fhir_resources.extend(medication_statements)
+    if nlp_results.get('medications'):
+        resource_groups.append(create_medication_statements(nlp_results, patient_id, now_iso, resource_ids))
     
-    conditions = create_condition_resources(nlp_results, patient_id)
-    fhir_resources.extend(conditions)
+    if nlp_results.get('diagnoses'):
+        resource_groups.append(create_condition_resources(nlp_results, patient_id, now_iso, resource_ids))
+    
+    # Flatten into a single list allocated at its final size
+    fhir_resources = list(chain.from_iterable(resource_groups))
     
     logger.info(f"Created {len(fhir_resources)} FHIR resources for patient {patient_id}")
     return fhir_resources
 
-def create_patient_from_phi(nlp_results: Dict[str, Any]) -> Dict[str, Any]:
+def create_patient_from_phi(nlp_results: Dict[str, Any], patient_id: str) -> Dict[str, Any]:
     """
     Create a Patient resource from PHI entities extracted by Comprehend Medical
     """
-    patient_id = str(uuid.uuid4())
     phi_entities = nlp_results.get('phi_entities', [])
     
     # Extract patient information from PHI entities
@@ -153,33 +407,28 @@ def create_patient_from_phi(nlp_results: Dict[str, Any]) -> Dict[str, Any]:
         'addresses': []
     }
     
+    # PHI type -> list it is collected into
+    phi_lists = {
+        'NAME': patient_info['names'],
+        'AGE': patient_info['ages'],
+        'ID': patient_info['ids'],
+        'DATE': patient_info['dates'],
+        'ADDRESS': patient_info['addresses']
+    }
+    
     # Process PHI entities to extract patient demographics
     for phi in phi_entities:
-        phi_type = phi.get('Type', '').upper()
-        phi_text = phi.get('Text', '').strip()
-        
-        if phi_type == 'NAME' and phi_text:
-            patient_info['names'].append(phi_text)
-        elif phi_type == 'AGE' and phi_text:
-            patient_info['ages'].append(phi_text)
-        elif phi_type == 'ID' and phi_text:
-            patient_info['ids'].append(phi_text)
-        elif phi_type == 'DATE' and phi_text:
-            patient_info['dates'].append(phi_text)
-        elif phi_type == 'ADDRESS' and phi_text:
-            patient_info['addresses'].append(phi_text)
+        phi_list = phi_lists.get(phi.get('Type', '').upper())
+        if phi_list is not None:
+            phi_text = phi.get('Text', '').strip()
+            if phi_text:
+                phi_list.append(phi_text)
     
     # Build Patient resource
     patient_resource = {
         'resourceType': 'Patient',
         'id': patient_id,
-        'meta': {
-            'tag': [{
-                'system': 'http://gocathlab.com/fhir/tags',
-                'code': 'nlp-extracted',
-                'display': 'NLP Extracted Patient'
-            }]
-        },
+        'meta': PATIENT_META,
         'active': True
     }
     
@@ -188,13 +437,7 @@ def create_patient_from_phi(nlp_results: Dict[str, Any]) -> Dict[str, Any]:
     for i, patient_id_text in enumerate(patient_info['ids']):
         identifiers.append({
             'use': 'usual',
-            'type': {
-                'coding': [{
-                    'system': 'http://terminology.hl7.org/CodeSystem/v2-0203',
-                    'code': 'MR',
-                    'display': 'Medical Record Number'
-                }]
-            },
+            'type': MEDICAL_RECORD_NUMBER_TYPE,
             'system': 'http://gocathlab.com/patient-id',
             'value': patient_id_text[:50]  # Limit length
         })
@@ -230,22 +473,18 @@ def create_patient_from_phi(nlp_results: Dict[str, Any]) -> Dict[str, Any]:
     
     # Add birth date if age found (approximate)
     if patient_info['ages']:
-        try:
-            age_text = patient_info['ages'][0]
-            # Extract numeric age
-            age_match = next((char for char in age_text if char.isdigit()), None)
-            if age_match:
-                age = int(''.join(filter(str.isdigit, age_text)))
-                if 0 < age < 150:  # Reasonable age range
-                    birth_year = datetime.now().year - age
-                    patient_resource['birthDate'] = f"{birth_year}-01-01"
-        except:
-            pass  # Skip if age parsing fails
+        # Extract numeric age
+        age_match = AGE_RE.search(patient_info['ages'][0])
+        if age_match:
+            age = int(age_match.group())
+            if 0 < age < 150:  # Reasonable age range
+                birth_year = datetime.now().year - age
+                patient_resource['birthDate'] = f"{birth_year}-01-01"
     
     # Add addresses if found
     if patient_info['addresses']:
         addresses = []
-        for addr_text in patient_info['addresses'][:1]:  # Use first address
+        for addr_text in islice(patient_info['addresses'], 1):  # Use first address
             addresses.append({
                 'use': 'home',
                 'text': addr_text[:200]  # Limit length
@@ -259,58 +498,42 @@ def create_patient_from_phi(nlp_results: Dict[str, Any]) -> Dict[str, Any]:
     
     return patient_resource
 
-def create_document_reference(nlp_results: Dict[str, Any], patient_id: str) -> Dict[str, Any]:
+def create_document_reference(nlp_results: Dict[str, Any], patient_id: str, now_iso: str, resource_ids: Iterator[str]) -> Dict[str, Any]:
     """
     Create a DocumentReference for the source clinical text
     """
-    doc_ref_id = str(uuid.uuid4())
+    doc_ref_id = next(resource_ids)
     
     # Determine document type based on source
     doc_type = 'clinical-note'
     if 'original_audio_file' in nlp_results:
         doc_type = 'audio-transcription'
     
-    # Get the text content
-    content_text = nlp_results.get('original_text', nlp_results.get('transcription_text', ''))
+    # Get the text content, encoded once for both size and data
+    content_bytes = load_source_text(nlp_results).encode('utf-8')
     
     return {
         'resourceType': 'DocumentReference',
         'id': doc_ref_id,
-        'meta': {
-            'tag': [{
-                'system': 'http://gocathlab.com/fhir/tags',
-                'code': 'nlp-source',
-                'display': 'NLP Source Document'
-            }]
-        },
+        'meta': DOCUMENT_META,
         'status': 'current',
-        'type': {
-            'coding': [{
-                'system': 'http://loinc.org',
-                'code': '11506-3',
-                'display': 'Progress note'
-            }]
-        },
+        'type': PROGRESS_NOTE_TYPE,
         'subject': {
             'reference': f'Patient/{patient_id}'
         },
-        'date': get_fhir_datetime(),
+        'date': now_iso,
         'content': [{
             'attachment': {
                 'contentType': 'text/plain',
-                'size': len(content_text.encode('utf-8')),
+                'size': len(content_bytes),
                 'title': 'Clinical Note',
-                'data': base64.b64encode(content_text.encode('utf-8')).decode('ascii')
+                'data': base64.b64encode(content_bytes).decode('ascii')
             },
-            'format': {
-                'system': 'http://ihe.net/fhir/ihe.formatcode.fhir/CodeSystem/formatcode',
-                'code': 'urn:ihe:iti:xds:2017:mimeTypeSufficient',
-                'display': 'mimeType Sufficient'
-            }
+            'format': MIME_TYPE_SUFFICIENT_FORMAT
         }]
     }
 
-def create_cardiovascular_observations(nlp_results: Dict[str, Any], patient_id: str) -> List[Dict[str, Any]]:
+def create_cardiovascular_observations(nlp_results: Dict[str, Any], patient_id: str, now_iso: str, resource_ids: Iterator[str]) -> List[Dict[str, Any]]:
     """
     Create Observation resources for cardiovascular entities
     """
@@ -319,39 +542,23 @@ def create_cardiovascular_observations(nlp_results: Dict[str, Any], patient_id:
     cardio_entities = nlp_results.get('cardiovascular_entities', [])
     
     # Create observations for cardiovascular entities only (limit cath lab for now)
-    for entity in cardio_entities[:5]:  # Limit to first 5 to avoid too many resources
-        obs_id = str(uuid.uuid4())
+    for entity in islice(cardio_entities, 5):  # Limit to first 5 to avoid too many resources
+        obs_id = next(resource_ids)
         
         observation = {
             'resourceType': 'Observation',
             'id': obs_id,
-            'meta': {
-                'tag': [{
-                    'system': 'http://gocathlab.com/fhir/tags',
-                    'code': 'nlp-extracted',
-                    'display': 'NLP Extracted'
-                }]
-            },
+            'meta': OBSERVATION_META,
             'status': 'final',
-            'category': [{
-                'coding': [{
-                    'system': 'http://terminology.hl7.org/CodeSystem/observation-category',
-                    'code': 'survey',
-                    'display': 'Survey'
-                }]
-            }],
+            'category': SURVEY_CATEGORY,
             'code': {
-                'coding': [{
-                    'system': 'http://snomed.info/sct',
-                    'code': '404684003',
-                    'display': 'Clinical finding'
-                }],
+                'coding': CLINICAL_FINDING_CODING,
                 'text': entity.get('text', '')[:50]  # Limit text length
             },
             'subject': {
                 'reference': f'Patient/{patient_id}'
             },
-            'effectiveDateTime': get_fhir_datetime(),
+            'effectiveDateTime': now_iso,
             'valueString': entity.get('text', '')[:100]  # Limit value length
             # Remove component for now to avoid validation issues
             # 'component': [{
@@ -370,7 +577,7 @@ def create_cardiovascular_observations(nlp_results: Dict[str, Any], patient_id:
     
     return observations
 
-def create_medication_statements(nlp_results: Dict[str, Any], patient_id: str) -> List[Dict[str, Any]]:
+def create_medication_statements(nlp_results: Dict[str, Any], patient_id: str, now_iso: str, resource_ids: Iterator[str]) -> List[Dict[str, Any]]:
     """
     Create MedicationStatement resources for detected medications
     """
@@ -378,19 +585,13 @@ def create_medication_statements(nlp_results: Dict[str, Any], patient_id: str) -
     
     medications = nlp_results.get('medications', [])
     
-    for medication in medications[:3]:  # Limit to first 3 medications
-        med_statement_id = str(uuid.uuid4())
+    for medication in islice(medications, 3):  # Limit to first 3 medications
+        med_statement_id = next(resource_ids)
         
         statement = {
             'resourceType': 'MedicationStatement',
             'id': med_statement_id,
-            'meta': {
-                'tag': [{
-                    'system': 'http://gocathlab.com/fhir/tags',
-                    'code': 'nlp-extracted',
-                    'display': 'NLP Extracted Medication'
-                }]
-            },
+            'meta': MEDICATION_META,
             'status': 'unknown',
             'medicationCodeableConcept': {
                 'text': medication.get('text', '')[:100]  # Limit text length
@@ -398,7 +599,7 @@ def create_medication_statements(nlp_results: Dict[str, Any], patient_id: str) -
             'subject': {
                 'reference': f'Patient/{patient_id}'
             },
-            'effectiveDateTime': get_fhir_datetime()
+            'effectiveDateTime': now_iso
         }
         
         medication_statements.append(statement)
@@ -419,13 +620,7 @@ def create_procedure_resources(nlp_results: Dict[str, Any], patient_id: str) ->
         proc_resource = {
             'resourceType': 'Procedure',
             'id': procedure_id,
-            'meta': {
-                'tag': [{
-                    'system': 'http://gocathlab.com/fhir/tags',
-                    'code': 'nlp-extracted',
-                    'display': 'NLP Extracted Procedure'
-                }]
-            },
+            'meta': PROCEDURE_META,
             'status': 'unknown',
             'code': {
                 'coding': [{
@@ -447,7 +642,7 @@ def create_procedure_resources(nlp_results: Dict[str, Any], patient_id: str) ->
     
     return procedures
 
-def create_condition_resources(nlp_results: Dict[str, Any], patient_id: str) -> List[Dict[str, Any]]:
+def create_condition_resources(nlp_results: Dict[str, Any], patient_id: str, now_iso: str, resource_ids: Iterator[str]) -> List[Dict[str, Any]]:
     """
     Create Condition resources for detected diagnoses
     """
@@ -455,40 +650,22 @@ def create_condition_resources(nlp_results: Dict[str, Any], patient_id: str) ->
     
     diagnoses = nlp_results.get('diagnoses', [])
     
-    for diagnosis in diagnoses[:3]:  # Limit to first 3 conditions
-        condition_id = str(uuid.uuid4())
+    for diagnosis in islice(diagnoses, 3):  # Limit to first 3 conditions
+        condition_id = next(resource_ids)
         
         condition = {
             'resourceType': 'Condition',
             'id': condition_id,
-            'meta': {
-                'tag': [{
-                    'system': 'http://gocathlab.com/fhir/tags',
-                    'code': 'nlp-extracted',
-                    'display': 'NLP Extracted Condition'
-                }]
-            },
-            'clinicalStatus': {
-                'coding': [{
-                    'system': 'http://terminology.hl7.org/CodeSystem/condition-clinical',
-                    'code': 'active',
-                    'display': 'Active'
-                }]
-            },
-            'verificationStatus': {
-                'coding': [{
-                    'system': 'http://terminology.hl7.org/CodeSystem/condition-ver-status',
-                    'code': 'unconfirmed',
-                    'display': 'Unconfirmed'
-                }]
-            },
+            'meta': CONDITION_META,
+            'clinicalStatus': CONDITION_ACTIVE_STATUS,
+            'verificationStatus': CONDITION_UNCONFIRMED_STATUS,
             'code': {
                 'text': diagnosis.get('text', '')[:100]  # Limit text length
             },
             'subject': {
                 'reference': f'Patient/{patient_id}'
             },
-            'recordedDate': get_fhir_datetime()
+            'recordedDate': now_iso
         }
         
         conditions.append(condition)
@@ -497,104 +674,158 @@ def create_condition_resources(nlp_results: Dict[str, Any], patient_id: str) ->
 
 def store_resources_in_healthlake(fhir_resources: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
-    Store FHIR resources in AWS HealthLake using the FHIR API
+    Store FHIR resources in AWS HealthLake using the FHIR API.
+    All resources are sent in one transaction Bundle, each entry a PUT
+    (create with specific ID), so one signed request stores the whole batch.
+    If the transaction is rejected, the resources are PUT individually so the
+    valid ones are still stored
     """
-    healthlake_endpoint = os.environ['HEALTHLAKE_ENDPOINT']
-    datastore_id = os.environ['DATASTORE_ID']
+    logger.info(f"Using FHIR base URL: {FHIR_BASE_URL}")
+    
+    bundle = {
+        'resourceType': 'Bundle',
+        'type': 'transaction',
+        'entry': [
+            {
+                'resource': resource,
+                'request': {
+                    'method': 'PUT',
+                    'url': f"{resource['resourceType']}/{resource['id']}"
+                }
+            }
+            for resource in fhir_resources
+        ]
+    }
     
-    responses = []
-    http = urllib3.PoolManager()
+    try:
+        response = send_fhir_request('POST', FHIR_BASE_URL, dump_json(bundle))
+        
+        logger.info(f"HealthLake transaction response for {len(fhir_resources)} resources: Status {response.status}")
+        
+        if response.status not in [200, 201]:
+            # The transaction is atomic, so none of the resources were stored
+            error_body = read_error_body(response)
+            logger.error(f"HealthLake validation error for transaction bundle: {error_body}")
+            return store_resources_individually(fhir_resources)
+        
+        response_entries = load_json(response.data).get('entry', [])
+        
+    except Exception as e:
+        logger.error(f"Error storing transaction bundle: {str(e)}")
+        return store_resources_individually(fhir_resources)
     
-    # Remove '/datastore/{id}' from endpoint if present and add it back
-    base_endpoint = healthlake_endpoint.split('/datastore/')[0] if '/datastore/' in healthlake_endpoint else healthlake_endpoint
-    fhir_base_url = f"{base_endpoint}/datastore/{datastore_id}/r4"
+    if len(response_entries) != len(fhir_resources):
+        # Entries cannot be matched to the resources they answer, so store each
+        # resource on its own; the PUTs are idempotent
+        logger.error(f"Transaction response has {len(response_entries)} entries for {len(fhir_resources)} resources")
+        return store_resources_individually(fhir_resources)
     
-    logger.info(f"Using FHIR base URL: {fhir_base_url}")
+    # Entries of the transaction-response Bundle are in request order
+    responses = []
+    for resource, entry in zip(fhir_resources, response_entries):
+        resource_type = resource['resourceType']
+        resource_id = resource['id']
+        entry_response = entry.get('response', {})
+        
+        # Entry status is e.g. '201 Created'
+        status_code = entry_response.get('status', '').split(' ')[0]
+        http_status = int(status_code) if status_code.isdigit() else None
+        
+        if http_status in [200, 201]:
+            response_data = {
+                'resourceType': resource_type,
+                'id': resource_id,
+                'status': 'created',
+                'httpStatus': http_status,
+                'location': f"{FHIR_BASE_URL}/{resource_type}/{resource_id}"
+            }
+            if 'resource' in entry:
+                response_data['fhir_response'] = entry['resource']
+        else:
+            response_data = {
+                'resourceType': resource_type,
+                'id': resource_id,
+                'status': 'error',
+                'httpStatus': http_status,
+                'error': entry_response.get('outcome', entry_response.get('status', 'Unknown error'))
+            }
+        
+        responses.append(response_data)
+        logger.debug("Stored %s with ID %s: %s", resource_type, resource_id, response_data['status'])
     
-    for resource in fhir_resources:
-        try:
-            resource_type = resource['resourceType']
-            resource_id = resource['id']
-            
-            # Create the FHIR resource using PUT (create with specific ID)
-            url = f"{fhir_base_url}/{resource_type}/{resource_id}"
-            
-            # Prepare the request
-            body = json.dumps(resource).encode('utf-8')
-            
-            # Create AWS request for signing
-            request = AWSRequest(
-                method='PUT',
-                url=url,
-                data=body,
-                headers={
-                    'Content-Type': 'application/fhir+json',
-                    'Accept': 'application/fhir+json'
-                }
-            )
-            
-            # Sign the request with AWS credentials
-            SigV4Auth(credentials, 'healthlake', session.region_name).add_auth(request)
-            
-            # Make the HTTP request
-            response = http.request(
-                method='PUT',
-                url=url,
-                body=body,
-                headers=dict(request.headers)
-            )
-            
-            logger.info(f"HealthLake response for {resource_type}/{resource_id}: Status {response.status}")
+    return responses
+
+def store_resources_individually(fhir_resources: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Store FHIR resources in AWS HealthLake with one PUT per resource,
+    sent concurrently
+    """
+    with ThreadPoolExecutor(max_workers=HEALTHLAKE_MAX_WORKERS) as executor:
+        return list(executor.map(put_resource, fhir_resources))
+
+def put_resource(resource: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Store a single FHIR resource in AWS HealthLake
+    """
+    try:
+        resource_type = resource['resourceType']
+        resource_id = resource['id']
+        
+        # Create the FHIR resource using PUT (create with specific ID)
+        url = f"{FHIR_BASE_URL}/{resource_type}/{resource_id}"
+        
+        response = send_fhir_request('PUT', url, dump_json(resource))
+        
+        logger.debug("HealthLake response for %s/%s: Status %s", resource_type, resource_id, response.status)
+        
+        if response.status in [200, 201]:
+            # Successfully created/updated
+            response_data = {
+                'resourceType': resource_type,
+                'id': resource_id,
+                'status': 'created',
+                'httpStatus': response.status,
+                'location': url
+            }
             
-            if response.status in [200, 201]:
-                # Successfully created/updated
-                response_data = {
-                    'resourceType': resource_type,
-                    'id': resource_id,
-                    'status': 'created',
-                    'httpStatus': response.status,
-                    'location': url
-                }
+            # Try to parse response body, decoding it only if it is not JSON
+            try:
+                response_data['fhir_response'] = load_json(response.data)
+            except ValueError:
+                response_data['raw_response'] = response.data.decode('utf-8', 'replace')
                 
-                # Try to parse response body
-                try:
-                    response_body = json.loads(response.data.decode('utf-8'))
-                    response_data['fhir_response'] = response_body
-                except:
-                    response_data['raw_response'] = response.data.decode('utf-8')
-                    
-            else:
-                # Error occurred
-                error_body = response.data.decode('utf-8') if response.data else 'Unknown error'
-                logger.error(f"HealthLake validation error for {resource_type}/{resource_id}: {error_body}")
-                
-                response_data = {
-                    'resourceType': resource_type,
-                    'id': resource_id,
-                    'status': 'error',
-                    'httpStatus': response.status,
-                    'error': error_body
-                }
-            
-            responses.append(response_data)
-            logger.info(f"Stored {resource_type} with ID {resource_id}: {response_data['status']}")
+        else:
+            # Error occurred
+            error_body = read_error_body(response)
+            logger.error("HealthLake validation error for %s/%s: %s", resource_type, resource_id, error_body)
             
-        except Exception as e:
-            logger.error(f"Error storing {resource.get('resourceType', 'Unknown')} resource: {str(e)}")
-            responses.append({
-                'resourceType': resource.get('resourceType', 'Unknown'),
-                'id': resource.get('id', 'Unknown'),
+            response_data = {
+                'resourceType': resource_type,
+                'id': resource_id,
                 'status': 'error',
-                'error': str(e)
-            })
-    
-    return responses
+                'httpStatus': response.status,
+                'error': error_body
+            }
+        
+        logger.debug("Stored %s with ID %s: %s", resource_type, resource_id, response_data['status'])
+        return response_data
+        
+    except Exception as e:
+        logger.error(f"Error storing {resource.get('resourceType', 'Unknown')} resource: {str(e)}")
+        return {
+            'resourceType': resource.get('resourceType', 'Unknown'),
+            'id': resource.get('id', 'Unknown'),
+            'status': 'error',
+            'error': str(e)
+        }
 
 def save_processing_summary(nlp_results: Dict[str, Any], fhir_resources: List[Dict[str, Any]], healthlake_responses: List[Dict[str, Any]]) -> None:
     """
     Save a summary of the FHIR processing results
     """
     try:
+        store_statuses = Counter(r.get('status') for r in healthlake_responses)
+        
         summary = {
             'timestamp': datetime.utcnow().isoformat(),
             'processing_id': str(uuid.uuid4()),
@@ -602,22 +833,20 @@ def save_processing_summary(nlp_results: Dict[str, Any], fhir_resources: List[Di
             'nlp_entities_processed': len(nlp_results.get('entities', [])),
             'fhir_resources_created': len(fhir_resources),
             'healthlake_responses': len(healthlake_responses),
-            'resource_breakdown': {
-                resource_type: len([r for r in fhir_resources if r['resourceType'] == resource_type])
-                for resource_type in set(r['resourceType'] for r in fhir_resources)
-            },
-            'successful_stores': len([r for r in healthlake_responses if r.get('status') == 'created']),
-            'failed_stores': len([r for r in healthlake_responses if r.get('status') == 'error'])
+            'resource_breakdown': dict(Counter(r['resourceType'] for r in fhir_resources)),
+            'successful_stores': store_statuses['created'],
+            'failed_stores': store_statuses['error']
         }
         
-        output_bucket = os.environ['NLP_OUTPUT_BUCKET']
+        output_bucket = NLP_OUTPUT_BUCKET
         summary_key = f"fhir-processing/summary_{summary['processing_id']}.json"
         
         s3_client.put_object(
             Bucket=output_bucket,
             Key=summary_key,
-            Body=json.dumps(summary, indent=2),
-            ContentType='application/json'
+            Body=gzip.compress(dump_json(summary), compresslevel=1),
+            ContentType='application/json',
+            ContentEncoding='gzip'
         )
         
         logger.info(f"Processing summary saved to: {summary_key}")
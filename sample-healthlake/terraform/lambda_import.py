@@ -1,134 +1,315 @@
 import json
+import hashlib
 import boto3
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+from concurrent.futures import ThreadPoolExecutor
 import os
 import logging
+import uuid
 from datetime import datetime
 from urllib.parse import unquote_plus
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize AWS clients
-healthlake_client = boto3.client('healthlake')
-s3_client = boto3.client('s3')
+# Configuration read once per container; a missing variable fails the cold start
+DATASTORE_ID = os.environ['HEALTHLAKE_DATASTORE_ID']
+IMPORT_ROLE_ARN = os.environ['HEALTHLAKE_IMPORT_ROLE_ARN']
+STAGING_BUCKET = os.environ['STAGING_BUCKET']
+
+# Initialize AWS clients. The connection pool is sized above the number of
+# record workers so concurrent GET/COPY calls never wait for a connection,
+# and kept alive for warm invocations.
+RECORD_MAX_WORKERS = 32
+
+CLIENT_CONFIG = Config(
+    max_pool_connections=64,
+    tcp_keepalive=True,
+    retries={'mode': 'adaptive'}
+)
+
+healthlake_client = boto3.client('healthlake', config=CLIENT_CONFIG)
+s3_client = boto3.client('s3', config=CLIENT_CONFIG)
+
+# Uploaded files imported into HealthLake: single JSON resources or NDJSON
+FHIR_FILE_SUFFIXES = ('.json', '.ndjson')
+
+# Fields each resource type must carry, beyond resourceType
+REQUIRED_FIELDS_BY_TYPE = {
+    'Observation': frozenset({'status', 'code', 'subject'}),
+    'Procedure': frozenset({'status', 'code', 'subject'})
+}
+NO_REQUIRED_FIELDS = frozenset()
+
+def load_json(data):
+    """
+    Parse JSON bytes, with orjson when it is packaged
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dump_json(obj):
+    """
+    Serialize to compact JSON bytes, with orjson when it is packaged
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
 
 def lambda_handler(event, context):
     """
     Lambda function to orchestrate FHIR data import into HealthLake
-    Triggered by S3 object creation events
+    Triggered by batches of SQS messages carrying S3 object creation
+    events. A single file is imported straight from the source bucket;
+    several files are staged under one batch prefix and imported with a
+    single job. Messages whose files could not be read, staged or imported are
+    reported as batch item failures so only they are retried
     """
     
-    # Get environment variables
-    datastore_id = os.environ['HEALTHLAKE_DATASTORE_ID']
-    import_role_arn = os.environ['HEALTHLAKE_IMPORT_ROLE_ARN']
-    staging_bucket = os.environ['STAGING_BUCKET']
+    staging_bucket = STAGING_BUCKET
+    
+    # One timestamp names the batch, its import job and its manifest
+    now = datetime.now()
+    timestamp = now.isoformat()
+    
+    batch_id = f"{now.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    # A short hash leads the batch prefix so batches spread across S3 partitions
+    batch_prefix = f"import-ready/{key_hash(batch_id)}/{batch_id}/"
+    
+    message_ids = [message['messageId'] for message in event['Records']]
+    failed_message_ids = set()
     
     try:
-        # Process each S3 event record
-        for record in event['Records']:
-            # Extract S3 event details
-            bucket_name = record['s3']['bucket']['name']
-            object_key = unquote_plus(record['s3']['object']['key'])
-            
-            logger.info(f"Processing file: s3://{bucket_name}/{object_key}")
-            
-            # Check if it's a FHIR JSON file
-            if not object_key.endswith('.json'):
-                logger.info(f"Skipping non-JSON file: {object_key}")
-                continue
-            
-            # Read the FHIR resource from S3
-            try:
-                response = s3_client.get_object(Bucket=bucket_name, Key=object_key)
-                fhir_content = response['Body'].read().decode('utf-8')
-                fhir_resource = json.loads(fhir_content)
-                
-                # Validate it's a FHIR resource
-                if 'resourceType' not in fhir_resource:
-                    logger.error(f"Invalid FHIR resource in {object_key}: missing resourceType")
+        s3_records = unpack_s3_records(event)
+        
+        with ThreadPoolExecutor(max_workers=RECORD_MAX_WORKERS) as executor:
+            # Validate the S3 event records concurrently, keeping the id of
+            # the message that delivered each valid file
+            reads = [executor.submit(read_fhir_record, s3_record) for _, s3_record in s3_records]
+            fhir_files = []
+            for (message_id, _), read in zip(s3_records, reads):
+                try:
+                    fhir_file = read.result()
+                except (BotoCoreError, ClientError) as e:
+                    # Throttling, server and network errors are retried with the message
+                    logger.error(f"Error reading FHIR file: {str(e)}")
+                    failed_message_ids.add(message_id)
                     continue
-                
-                logger.info(f"Found FHIR {fhir_resource['resourceType']} resource")
-                
-            except Exception as e:
-                logger.error(f"Error reading FHIR resource from {object_key}: {str(e)}")
-                continue
-            
-            # Copy file to staging bucket for HealthLake import
-            staging_key = f"import-ready/{datetime.now().strftime('%Y/%m/%d')}/{object_key.split('/')[-1]}"
+                if fhir_file is not None:
+                    fhir_files.append((message_id, fhir_file))
             
-            try:
-                # Copy to staging bucket
-                copy_source = {'Bucket': bucket_name, 'Key': object_key}
-                s3_client.copy_object(
-                    CopySource=copy_source,
-                    Bucket=staging_bucket,
-                    Key=staging_key,
-                    MetadataDirective='COPY'
+            # HealthLake imports one object or one prefix per job, so only
+            # multiple files need copying under a common prefix
+            if len(fhir_files) > 1:
+                staged = executor.map(
+                    lambda item: copy_to_staging(item[1], staging_bucket, batch_prefix),
+                    fhir_files
                 )
-                
-                logger.info(f"Copied to staging: s3://{staging_bucket}/{staging_key}")
-                
-                # Create HealthLake import job
+                staged_files = []
+                for (message_id, _), fhir_file in zip(fhir_files, staged):
+                    if fhir_file is None:
+                        failed_message_ids.add(message_id)
+                    else:
+                        staged_files.append((message_id, fhir_file))
+                fhir_files = staged_files
+        
+        if not fhir_files:
+            logger.info("No valid FHIR files to import")
+            return batch_response(failed_message_ids)
+        
+        import_message_ids = {message_id for message_id, _ in fhir_files}
+        fhir_files = [fhir_file for _, fhir_file in fhir_files]
+        
+        # Redelivered events for the same objects get the same token, so
+        # HealthLake does not start a duplicate job
+        client_token = import_client_token(
+            DATASTORE_ID,
+            [f"{fhir_file['sourceFile']}#{fhir_file['sourceETag']}" for fhir_file in fhir_files]
+        )
+        
+        try:
+            if 'stagingFile' in fhir_files[0]:
+                # Create one HealthLake import job for the whole batch
+                import_job_response = process_batch_import(staging_bucket, batch_prefix, client_token=client_token, now=now)
+                input_uri = f"s3://{staging_bucket}/{batch_prefix}"
+            else:
+                # Import the single file in place, without copying it
+                fhir_file = fhir_files[0]
                 import_job_response = start_healthlake_import(
-                    datastore_id,
-                    staging_bucket,
-                    staging_key,
-                    import_role_arn,
-                    fhir_resource['resourceType']
+                    DATASTORE_ID,
+                    fhir_file['sourceBucket'],
+                    fhir_file['sourceKey'],
+                    IMPORT_ROLE_ARN,
+                    fhir_file['resourceType'],
+                    output_bucket=staging_bucket,
+                    client_token=client_token,
+                    now=now
                 )
-                
-                logger.info(f"Started HealthLake import job: {import_job_response['JobId']}")
-                
-                # Store job metadata for tracking
-                job_metadata = {
-                    'jobId': import_job_response['JobId'],
-                    'status': import_job_response['JobStatus'],
-                    'submittedAt': datetime.now().isoformat(),  # Use current time instead
-                    'sourceFile': f"s3://{bucket_name}/{object_key}",
-                    'stagingFile': f"s3://{staging_bucket}/{staging_key}",
-                    'resourceType': fhir_resource['resourceType'],
-                    'resourceId': fhir_resource.get('id', 'unknown')
-                }
-                
-                # Store job tracking info in S3
-                tracking_key = f"import-jobs/{import_job_response['JobId']}.json"
-                s3_client.put_object(
-                    Bucket=staging_bucket,
-                    Key=tracking_key,
-                    Body=json.dumps(job_metadata, indent=2),
-                    ContentType='application/json'
-                )
-                
-            except Exception as e:
-                logger.error(f"Error processing HealthLake import for {object_key}: {str(e)}")
-                continue
-        
-        return {
-            'statusCode': 200,
-            'body': json.dumps({
-                'message': f'Successfully processed {len(event["Records"])} files',
-                'timestamp': datetime.now().isoformat()
-            })
+                input_uri = fhir_file['sourceFile']
+        except Exception:
+            # Every file waiting for the job is retried
+            failed_message_ids |= import_message_ids
+            raise
+        
+        logger.info(f"Started HealthLake import job: {import_job_response['JobId']}")
+        
+        # Store one NDJSON manifest per import job, with a line per file,
+        # under a date prefix so a day's imports can be listed or queried
+        job_metadata = {
+            'jobId': import_job_response['JobId'],
+            'status': import_job_response['JobStatus'],
+            'submittedAt': timestamp,
+            'inputUri': input_uri
         }
         
+        tracking_key = f"import-jobs/{now.strftime('%Y/%m/%d')}/{import_job_response['JobId']}.ndjson"
+        s3_client.put_object(
+            Bucket=staging_bucket,
+            Key=tracking_key,
+            Body=b'\n'.join(dump_json({**job_metadata, **fhir_file}) for fhir_file in fhir_files),
+            ContentType='application/x-ndjson'
+        )
+        
+        logger.info(f"Submitted {len(fhir_files)} of {len(s3_records)} files for import at {timestamp}")
+        
     except Exception as e:
         logger.error(f"Error in lambda_handler: {str(e)}")
-        return {
-            'statusCode': 500,
-            'body': json.dumps({
-                'error': str(e),
-                'timestamp': datetime.now().isoformat()
-            })
-        }
+        if not failed_message_ids:
+            # The failure happened before any file was handled, so retry the whole batch
+            failed_message_ids = set(message_ids)
+    
+    return batch_response(failed_message_ids)
 
-def start_healthlake_import(datastore_id, bucket, key, role_arn, resource_type):
+def unpack_s3_records(event):
+    """
+    Unpack the S3 event records carried by the SQS messages of an event,
+    paired with the id of the message that carried each. S3 test events
+    carry no records
     """
-    Start a HealthLake import job for a single FHIR resource
+    s3_records = []
+    for message in event['Records']:
+        s3_event = load_json(message['body'])
+        for s3_record in s3_event.get('Records', ()):
+            s3_records.append((message['messageId'], s3_record))
+    return s3_records
+
+def batch_response(failed_message_ids):
+    """
+    Build the partial batch response telling SQS which messages to retry
+    """
+    if failed_message_ids:
+        logger.warning(f"Retrying {len(failed_message_ids)} messages")
+    return {
+        'batchItemFailures': [
+            {'itemIdentifier': message_id} for message_id in sorted(failed_message_ids)
+        ]
+    }
+
+def read_fhir_record(record):
     """
+    Read and validate the FHIR file of an S3 event record. Returns the
+    file's details, or None if the file was skipped or is not valid FHIR.
+    Errors reading the file from S3 are raised, so its message is retried
+    """
+    # Extract S3 event details
+    bucket_name = record['s3']['bucket']['name']
+    object_key = unquote_plus(record['s3']['object']['key'])
+    
+    logger.info(f"Processing file: s3://{bucket_name}/{object_key}")
+    
+    # Check if it's a FHIR JSON or NDJSON file
+    if not object_key.endswith(FHIR_FILE_SUFFIXES):
+        logger.info(f"Skipping non-JSON file: {object_key}")
+        return None
+    
+    # Read the FHIR resource from S3
+    response = s3_client.get_object(Bucket=bucket_name, Key=object_key)
+    body = response['Body'].read()
+    if object_key.endswith('.ndjson'):
+        # Validate NDJSON by its first resource
+        body = body.lstrip().split(b'\n', 1)[0]
+    
+    try:
+        fhir_resource = load_json(body)
+    except ValueError as e:
+        logger.error(f"Invalid JSON in {object_key}: {str(e)}")
+        return None
+    
+    # Validate it's a FHIR resource
+    if not isinstance(fhir_resource, dict) or 'resourceType' not in fhir_resource:
+        logger.error(f"Invalid FHIR resource in {object_key}: missing resourceType")
+        return None
+    
+    logger.info(f"Found FHIR {fhir_resource['resourceType']} resource")
+    
+    return {
+        'sourceFile': f"s3://{bucket_name}/{object_key}",
+        'sourceBucket': bucket_name,
+        'sourceKey': object_key,
+        'sourceETag': record['s3']['object'].get('eTag', ''),
+        'resourceType': fhir_resource['resourceType'],
+        'resourceId': fhir_resource.get('id', 'unknown')
+    }
+
+def copy_to_staging(fhir_file, staging_bucket, batch_prefix):
+    """
+    Copy a validated FHIR file to the batch prefix in the staging bucket.
+    Returns the file's details with its staging location, or None if the
+    copy failed
+    """
+    # Files keep their name under a hash of their source key, so same-named
+    # files from different folders do not overwrite each other
+    source_key = fhir_file['sourceKey']
+    staging_key = f"{batch_prefix}{key_hash(source_key)}/{source_key.split('/')[-1]}"
+    
+    try:
+        copy_source = {'Bucket': fhir_file['sourceBucket'], 'Key': fhir_file['sourceKey']}
+        s3_client.copy_object(
+            CopySource=copy_source,
+            Bucket=staging_bucket,
+            Key=staging_key,
+            MetadataDirective='COPY'
+        )
+        
+        logger.info(f"Copied to staging: s3://{staging_bucket}/{staging_key}")
+        
+    except Exception as e:
+        logger.error(f"Error staging {fhir_file['sourceKey']}: {str(e)}")
+        return None
     
-    job_name = f"import-{resource_type}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    return {**fhir_file, 'stagingFile': f"s3://{staging_bucket}/{staging_key}"}
+
+def key_hash(value):
+    """
+    Short hex hash of a string, used to spread S3 keys across prefixes
+    """
+    return hashlib.blake2b(value.encode('utf-8'), digest_size=2).hexdigest()
+
+def import_client_token(datastore_id, source_objects):
+    """
+    Derive the idempotency token of an import job from the datastore and
+    its source objects, in any order
+    """
+    digest = hashlib.sha256(datastore_id.encode('utf-8'))
+    for source_object in sorted(source_objects):
+        digest.update(b'\n' + source_object.encode('utf-8'))
+    return digest.hexdigest()
+
+def start_healthlake_import(datastore_id, bucket, key, role_arn, resource_type, output_bucket=None, client_token=None, now=None):
+    """
+    Start a HealthLake import job for a single FHIR resource.
+    Results are written to output_bucket, or to the input bucket if not given
+    """
+    now = now or datetime.now()
+    job_name = f"import-{resource_type}-{now.strftime('%Y%m%d-%H%M%S')}"
     
     try:
         response = healthlake_client.start_fhir_import_job(
@@ -138,13 +319,13 @@ def start_healthlake_import(datastore_id, bucket, key, role_arn, resource_type):
             },
             JobOutputDataConfig={
                 'S3Configuration': {
-                    'S3Uri': f"s3://{bucket}/import-results/",
+                    'S3Uri': f"s3://{output_bucket or bucket}/import-results/",
                     'KmsKeyId': 'alias/aws/s3'  # Use AWS managed S3 key
                 }
             },
             DatastoreId=datastore_id,
             DataAccessRoleArn=role_arn,
-            ClientToken=f"{job_name}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+            ClientToken=client_token or f"{job_name}-{now.strftime('%Y%m%d%H%M%S')}"
         )
         
         return response
@@ -157,30 +338,19 @@ def validate_fhir_resource(resource):
     """
     Basic validation of FHIR resource structure
     """
-    required_fields = ['resourceType']
-    
-    for field in required_fields:
-        if field not in resource:
-            return False, f"Missing required field: {field}"
-    
-    # Additional validation for specific resource types
     resource_type = resource.get('resourceType')
+    if resource_type is None:
+        return False, "Missing required field: resourceType"
     
+    # Additional validation for specific resource types
     if resource_type == 'Patient':
         if 'identifier' not in resource and 'name' not in resource:
             return False, "Patient resource must have either identifier or name"
+        return True, "Valid FHIR resource"
     
-    elif resource_type == 'Observation':
-        required_obs_fields = ['status', 'code', 'subject']
-        for field in required_obs_fields:
-            if field not in resource:
-                return False, f"Observation missing required field: {field}"
-    
-    elif resource_type == 'Procedure':
-        required_proc_fields = ['status', 'code', 'subject']
-        for field in required_proc_fields:
-            if field not in resource:
-                return False, f"Procedure missing required field: {field}"
+    missing_fields = REQUIRED_FIELDS_BY_TYPE.get(resource_type, NO_REQUIRED_FIELDS) - resource.keys()
+    if missing_fields:
+        return False, f"{resource_type} missing required field: {', '.join(sorted(missing_fields))}"
     
     return True, "Valid FHIR resource"
 
@@ -190,7 +360,7 @@ def get_import_job_status(job_id):
     """
     try:
         response = healthlake_client.describe_fhir_import_job(
-            DatastoreId=os.environ['HEALTHLAKE_DATASTORE_ID'],
+            DatastoreId=DATASTORE_ID,
             JobId=job_id
         )
         return response
@@ -198,15 +368,13 @@ def get_import_job_status(job_id):
         logger.error(f"Error getting import job status: {str(e)}")
         return None
 
-def process_batch_import(bucket, prefix):
+def process_batch_import(bucket, prefix, client_token=None, now=None):
     """
     Process multiple FHIR files as a batch import
     This function can be called separately for bulk imports
     """
-    datastore_id = os.environ['HEALTHLAKE_DATASTORE_ID']
-    import_role_arn = os.environ['HEALTHLAKE_IMPORT_ROLE_ARN']
-    
-    job_name = f"batch-import-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    now = now or datetime.now()
+    job_name = f"batch-import-{now.strftime('%Y%m%d-%H%M%S')}"
     
     try:
         response = healthlake_client.start_fhir_import_job(
@@ -220,9 +388,9 @@ def process_batch_import(bucket, prefix):
                     'KmsKeyId': 'alias/aws/s3'  # Use AWS managed S3 key
                 }
             },
-            DatastoreId=datastore_id,
-            DataAccessRoleArn=import_role_arn,
-            ClientToken=f"{job_name}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+            DatastoreId=DATASTORE_ID,
+            DataAccessRoleArn=IMPORT_ROLE_ARN,
+            ClientToken=client_token or f"{job_name}-{now.strftime('%Y%m%d%H%M%S')}"
         )
         
         logger.info(f"Started batch import job: {response['JobId']}")
@@ -251,6 +251,18 @@ resource "aws_iam_policy" "healthlake_import_policy" {
           "${aws_s3_bucket.healthlake_staging.arn}/*"
         ]
       },
+      {
+        # Single uploaded files are imported in place from the source bucket
+        Effect = "Allow"
+        Action = [
+          "s3:GetObject",
+          "s3:ListBucket"
+        ]
+        Resource = [
+          aws_s3_bucket.fhir_source_data.arn,
+          "${aws_s3_bucket.fhir_source_data.arn}/*"
+        ]
+      },
       {
         Effect = "Allow"
         Action = [
@@ -455,6 +467,15 @@ resource "aws_iam_policy" "lambda_import_policy" {
           "iam:PassRole"
         ]
         Resource = aws_iam_role.healthlake_import_role.arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "sqs:ReceiveMessage",
+          "sqs:DeleteMessage",
+          "sqs:GetQueueAttributes"
+        ]
+        Resource = aws_sqs_queue.fhir_upload_events.arn
       }
     ]
   })
@@ -476,6 +497,10 @@ resource "aws_lambda_function" "healthlake_import_orchestrator" {
   handler         = "lambda_function.lambda_handler"
   runtime         = "python3.9"
   timeout         = 300
+  architectures   = ["arm64"]
+  # Network and CPU scale with memory; sized for batches of up to 1000
+  # files read and staged by 32 threads
+  memory_size     = 1024
 
   environment {
     variables = {
@@ -507,26 +532,86 @@ data "archive_file" "lambda_zip" {
   }
 }
 
-# S3 notification to trigger Lambda when FHIR data is uploaded
+# Queue buffering FHIR upload events, so one import invocation handles many files
+resource "aws_sqs_queue" "fhir_upload_events" {
+  name                       = "${var.project_name}-fhir-upload-events"
+  # Six times the function timeout, so batches in flight are not redelivered
+  visibility_timeout_seconds = 1800
+  message_retention_seconds  = 345600
+
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.fhir_upload_events_dlq.arn
+    maxReceiveCount     = 5
+  })
+
+  tags = {
+    Name = "${var.project_name}-fhir-upload-events"
+  }
+}
+
+# Upload events that repeatedly failed to import
+resource "aws_sqs_queue" "fhir_upload_events_dlq" {
+  name                      = "${var.project_name}-fhir-upload-events-dlq"
+  message_retention_seconds = 1209600
+
+  tags = {
+    Name = "${var.project_name}-fhir-upload-events-dlq"
+  }
+}
+
+# Permission for S3 to send upload events to the queue
+resource "aws_sqs_queue_policy" "fhir_upload_events" {
+  queue_url = aws_sqs_queue.fhir_upload_events.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Principal = {
+          Service = "s3.amazonaws.com"
+        }
+        Action   = "sqs:SendMessage"
+        Resource = aws_sqs_queue.fhir_upload_events.arn
+        Condition = {
+          ArnEquals = {
+            "aws:SourceArn" = aws_s3_bucket.fhir_source_data.arn
+          }
+        }
+      }
+    ]
+  })
+}
+
+# S3 notification to queue an event when FHIR data is uploaded
 resource "aws_s3_bucket_notification" "fhir_data_upload" {
   bucket = aws_s3_bucket.fhir_source_data.id
 
-  lambda_function {
-    lambda_function_arn = aws_lambda_function.healthlake_import_orchestrator.arn
-    events              = ["s3:ObjectCreated:*"]
-    filter_suffix       = ".json"
+  queue {
+    queue_arn     = aws_sqs_queue.fhir_upload_events.arn
+    events        = ["s3:ObjectCreated:*"]
+    filter_suffix = ".json"
   }
 
-  depends_on = [aws_lambda_permission.allow_s3_invoke]
+  queue {
+    queue_arn     = aws_sqs_queue.fhir_upload_events.arn
+    events        = ["s3:ObjectCreated:*"]
+    filter_suffix = ".ndjson"
+  }
+
+  depends_on = [aws_sqs_queue_policy.fhir_upload_events]
 }
 
-# Permission for S3 to invoke Lambda
-resource "aws_lambda_permission" "allow_s3_invoke" {
-  statement_id  = "AllowExecutionFromS3Bucket"
-  action        = "lambda:InvokeFunction"
-  function_name = aws_lambda_function.healthlake_import_orchestrator.function_name
-  principal     = "s3.amazonaws.com"
-  source_arn    = aws_s3_bucket.fhir_source_data.arn
+# Deliver queued upload events to the import Lambda in batches, retrying
+# only the messages whose files failed
+resource "aws_lambda_event_source_mapping" "fhir_upload_events" {
+  event_source_arn                   = aws_sqs_queue.fhir_upload_events.arn
+  function_name                      = aws_lambda_function.healthlake_import_orchestrator.arn
+  batch_size                         = 1000
+  maximum_batching_window_in_seconds = 30
+  function_response_types            = ["ReportBatchItemFailures"]
+
+  depends_on = [aws_iam_role_policy_attachment.lambda_import_attachment]
 }
 
 # S3 objects for sample cardiovascular FHIR data
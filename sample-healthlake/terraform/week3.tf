@@ -245,6 +245,10 @@ data "archive_file" "lambda_zip_clinical_notes_nlp" {
     content  = file("${path.module}/clinical_notes_nlp.py")
     filename = "index.py"
   }
+  source {
+    content  = file("${path.module}/comprehend_medical.py")
+    filename = "comprehend_medical.py"
+  }
 }
 
 # ============================================================================
@@ -285,6 +289,76 @@ data "archive_file" "lambda_zip_audio_transcription" {
     content  = file("${path.module}/audio_transcription.py")
     filename = "index.py"
   }
+  source {
+    content  = file("${path.module}/comprehend_medical.py")
+    filename = "comprehend_medical.py"
+  }
+}
+
+# ============================================================================
+# Lambda Function: Audio Transcription Completion Processor
+# ============================================================================
+
+# Shares the audio transcription package; runs when Transcribe reports a
+# finished job so no Lambda sits billed while the transcription runs
+resource "aws_lambda_function" "transcription_completion" {
+  filename         = "audio_transcription.zip"
+  function_name    = "${var.project_name}-transcription-completion"
+  role            = aws_iam_role.nlp_lambda_role.arn
+  handler         = "index.transcription_completion_handler"
+  runtime         = "python3.9"
+  timeout         = 300
+
+  environment {
+    variables = {
+      NLP_OUTPUT_BUCKET = aws_s3_bucket.nlp_output.bucket
+      TRANSCRIPTION_RESULTS_BUCKET = aws_s3_bucket.nlp_output.bucket
+    }
+  }
+
+  tags = {
+    Name    = "Audio Transcription Completion Processor"
+    Project = var.project_name
+    Week    = "3"
+  }
+
+  depends_on = [
+    data.archive_file.lambda_zip_audio_transcription,
+    aws_iam_role_policy_attachment.nlp_lambda_policy_attachment
+  ]
+}
+
+resource "aws_cloudwatch_event_rule" "transcription_job_state_change" {
+  name        = "${var.project_name}-transcription-job-state-change"
+  description = "Triggered when a Transcribe job completes or fails"
+
+  event_pattern = jsonencode({
+    source      = ["aws.transcribe"]
+    detail-type = ["Transcribe Job State Change"]
+    detail = {
+      TranscriptionJobStatus = ["COMPLETED", "FAILED"]
+    }
+  })
+
+  tags = {
+    Name    = "Transcription Job State Change Rule"
+    Project = var.project_name
+    Week    = "3"
+  }
+}
+
+resource "aws_cloudwatch_event_target" "transcription_completion_target" {
+  rule      = aws_cloudwatch_event_rule.transcription_job_state_change.name
+  target_id = "TranscriptionCompletionTarget"
+  arn       = aws_lambda_function.transcription_completion.arn
+}
+
+resource "aws_lambda_permission" "transcription_completion_eventbridge" {
+  statement_id  = "AllowExecutionFromEventBridge"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.transcription_completion.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.transcription_job_state_change.arn
 }
 # ============================================================================
 # Lambda Function: FHIR Resource Creator
@@ -434,6 +508,17 @@ resource "aws_cloudwatch_log_group" "audio_transcription_logs" {
   }
 }
 
+resource "aws_cloudwatch_log_group" "transcription_completion_logs" {
+  name              = "/aws/lambda/${aws_lambda_function.transcription_completion.function_name}"
+  retention_in_days = 14
+
+  tags = {
+    Name    = "Transcription Completion Logs"
+    Project = var.project_name
+    Week    = "3"
+  }
+}
+
 resource "aws_cloudwatch_log_group" "fhir_resource_creator_logs" {
   name              = "/aws/lambda/${aws_lambda_function.fhir_resource_creator.function_name}"
   retention_in_days = 14
@@ -511,6 +596,11 @@ output "audio_transcription_function" {
   value       = aws_lambda_function.audio_transcription.function_name
 }
 
+output "transcription_completion_function" {
+  description = "Transcription Completion Lambda function name"
+  value       = aws_lambda_function.transcription_completion.function_name
+}
+
 output "fhir_resource_creator_function" {
   description = "FHIR Resource Creator Lambda function name"
   value       = aws_lambda_function.fhir_resource_creator.function_name